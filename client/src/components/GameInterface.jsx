@@ -4,6 +4,8 @@ import Chat from './Chat';
 import VideoCall from './VideoCall';
 import { Chess } from 'chess.js';
 
+const MAX_RECONNECT_ATTEMPTS = 8;
+
 const GameInterface = ({ roomId, playerName, playerColor, opponentName: initialOpponentName, initialFen, initialMoves }) => {
     const [game, setGame] = useState(new Chess(initialFen || 'start'));
     const [fen, setFen] = useState(initialFen || 'start');
@@ -14,63 +16,150 @@ const GameInterface = ({ roomId, playerName, playerColor, opponentName: initialO
     const [opponentName, setOpponentName] = useState(initialOpponentName);
     const [opponentPeerId, setOpponentPeerId] = useState(null);
     const socket = useRef(null);
+    // number of half-moves applied locally, used to detect missed move events
+    const plyRef = useRef((initialMoves || []).length);
+    // latest position and whether the game is over, read when a dropped
+    // socket comes back
+    const gameRef = useRef(game);
+    const finishedRef = useRef(false);
+    // remaining seconds as reported by the server, and when we received them
+    const [clock, setClock] = useState(null);
+    const [, setTick] = useState(0);
 
     useEffect(() => {
         if (!roomId) return;
-        const socketUrl = `ws://localhost:8000/ws/match/${roomId}/`;
-        socket.current = new WebSocket(socketUrl);
-
-        socket.current.onopen = () => console.log('WebSocket connection established.');
-        socket.current.onclose = () => setStatus('Connection Lost. Please refresh.');
-
-        socket.current.onerror = (error) => console.log('WebSocket Error:', error);
-        socket.current.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-
-            switch (data.type) {
-                case 'game_state_update':
-                    const newGame = new Chess(data.fen);
-                    setGame(newGame);
-                    setFen(data.fen);
-                    setMoveHistory(data.moves || []);
+        let closedByUs = false;
+        let connectedOnce = false;
+        let attempts = 0;
+        let retryTimer = null;
+
+        const openSocket = () => {
+            // after a drop, ask only for the moves we missed
+            const since = connectedOnce ? `?since=${plyRef.current}` : '';
+            const ws = new WebSocket(`ws://localhost:8000/ws/match/${roomId}/${since}`);
+            socket.current = ws;
+
+            ws.onopen = () => {
+                console.log('WebSocket connection established.');
+                if (connectedOnce && !finishedRef.current) updateStatus(gameRef.current);
+                connectedOnce = true;
+                attempts = 0;
+            };
+            ws.onclose = () => {
+                if (closedByUs || finishedRef.current) return;
+                if (attempts >= MAX_RECONNECT_ATTEMPTS) {
+                    setStatus('Connection Lost. Please refresh.');
+                    return;
+                }
+                setStatus('Connection lost. Reconnecting...');
+                retryTimer = setTimeout(openSocket, Math.min(500 * 2 ** attempts, 8000));
+                attempts += 1;
+            };
+
+            ws.onerror = (error) => console.log('WebSocket Error:', error);
+            ws.onmessage = (event) => {
+                const data = JSON.parse(event.data);
+
+                switch (data.type) {
+                    case 'game_state_update':
+                        const newGame = new Chess(data.fen);
+                        gameRef.current = newGame;
+                        setGame(newGame);
+                        setFen(data.fen);
+                        setMoveHistory(data.moves || []);
+                        plyRef.current = data.ply;
+                        setClock(data.clock && { ...data.clock, receivedAt: Date.now() });
                     
-                    if (playerColor === 'white') {
-                        setOpponentName(data.black_player || 'Waiting...');
-                    } else {
-                        setOpponentName(data.white_player || 'Waiting...');
+                        if (playerColor === 'white') {
+                            setOpponentName(data.black_player || 'Waiting...');
+                        } else {
+                            setOpponentName(data.white_player || 'Waiting...');
+                        }
+                        updateStatus(newGame);
+                        if (data.status === 'finished') {
+                            finishedRef.current = true;
+                            setStatus(describeResult(data));
+                        }
+                        break;
+
+                    case 'move_made': {
+                        if (data.ply <= plyRef.current) break;
+                        if (data.ply !== plyRef.current + 1) {
+                            // we missed at least one move, ask for just those
+                            socket.current.send(JSON.stringify({ type: 'resume', ply: plyRef.current }));
+                            break;
+                        }
+                        plyRef.current = data.ply;
+                        const nextGame = new Chess(data.fen);
+                        gameRef.current = nextGame;
+                        setGame(nextGame);
+                        setFen(data.fen);
+                        setMoveHistory(prev => [...prev, data.move]);
+                        setClock(data.clock && { ...data.clock, receivedAt: Date.now() });
+                        updateStatus(nextGame);
+                        if (data.status === 'finished') {
+                            finishedRef.current = true;
+                            setStatus(describeResult(data));
+                        }
+                        break;
                     }
-                    updateStatus(newGame);
-                    break;
 
-                case 'chat_message':
-                    setChatMessages(prev => [...prev, { sender: data.sender, message: data.message, isSent: false }]);
-                    break;
+                    case 'game_over':
+                        finishedRef.current = true;
+                        setClock(data.clock && { ...data.clock, receivedAt: Date.now() });
+                        setStatus(describeResult(data));
+                        break;
+
+                    case 'chat_message':
+                        setChatMessages(prev => [...prev, { sender: data.sender, message: data.message, isSent: false }]);
+                        break;
                 
-                case 'video_signal':
-                    if (data.sender !== playerName) {
-                        setOpponentPeerId(data.peerId);
-                    }
-                    break;
+                    case 'video_signal':
+                        if (data.sender !== playerName) {
+                            setOpponentPeerId(data.peerId);
+                        }
+                        break;
                 
-                case 'error':
-                    // revert if illegal move
-                    console.error('Server error:', data.message);
-                    setFen(game.fen());
-                    updateStatus(game);
-                    break;
+                    case 'error':
+                        // revert if illegal move
+                        console.error('Server error:', data.message);
+                        setFen(gameRef.current.fen());
+                        updateStatus(gameRef.current);
+                        break;
                 
-                default:
-                    break;
-            }
+                    default:
+                        break;
+                }
+            };
         };
 
+        openSocket();
+
         return () => {
+            closedByUs = true;
+            clearTimeout(retryTimer);
             if (socket.current) {
                 socket.current.close();
             }
         };
     }, [roomId, playerName, playerColor]);
     
+    useEffect(() => {
+        if (!clock?.running) return;
+        const timer = setInterval(() => setTick(t => t + 1), 250);
+        return () => clearInterval(timer);
+    }, [clock]);
+
+    const timeLeft = (color) => {
+        if (!clock) return null;
+        let seconds = clock[color];
+        if (clock.running === color) {
+            seconds -= (Date.now() - clock.receivedAt) / 1000;
+        }
+        seconds = Math.max(Math.ceil(seconds), 0);
+        return `${Math.floor(seconds / 60)}:${String(seconds % 60).padStart(2, '0')}`;
+    };
+
     const updateStatus = useCallback((currentGame) => {
         let statusText = '';
         const moveColor = currentGame.turn() === 'b' ? 'Black' : 'White';
@@ -88,6 +177,13 @@ const GameInterface = ({ roomId, playerName, playerColor, opponentName: initialO
         setStatus(statusText);
     }, []);
     
+    const describeResult = (data) => {
+        const reason = (data.termination || '').replaceAll('_', ' ');
+        if (data.result === '1-0') return `White wins (${reason}).`;
+        if (data.result === '0-1') return `Black wins (${reason}).`;
+        return `Draw (${reason}).`;
+    };
+
     const sendSocketMessage = useCallback((data) => {
         if (socket.current && socket.current.readyState === WebSocket.OPEN) {
             socket.current.send(JSON.stringify(data));
@@ -108,7 +204,12 @@ const GameInterface = ({ roomId, playerName, playerColor, opponentName: initialO
         // we optimistically update the UI first
         if (moveResult !== null) {
             setFen(gameCopy.fen());
-            sendSocketMessage({ type: 'move', from: sourceSquare, to: targetSquare });
+            sendSocketMessage({
+                type: 'move',
+                from: sourceSquare,
+                to: targetSquare,
+                ...(moveResult.promotion && { promotion: moveResult.promotion }),
+            });
             updateStatus(gameCopy);
             return true;
         }
@@ -138,6 +239,9 @@ const GameInterface = ({ roomId, playerName, playerColor, opponentName: initialO
                     <p>Room ID: <strong>{roomId}</strong></p>
                     <p>Your Name: <strong>{playerName} ({playerColor})</strong></p>
                     <p>Opponent: <strong>{opponentName}</strong></p>
+                    {clock && (
+                        <p>Clock: <strong>White {timeLeft('white')} / Black {timeLeft('black')}</strong></p>
+                    )}
                 </div>
             </div>
 
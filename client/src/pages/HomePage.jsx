@@ -1,15 +1,28 @@
-import { useState, useEffect } from 'react'; 
+import { useState, useEffect, useRef } from 'react'; 
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { useAuth } from '../context/AuthContext';
 import './HomePage.css';  
 
+// base and increment in seconds, keyed by the value of the select below
+const TIME_CONTROLS = {
+  unlimited: null,
+  '3+2': { base: 180, increment: 2 },
+  '5+0': { base: 300, increment: 0 },
+  '10+5': { base: 600, increment: 5 },
+};
+
 const HomePage = () => {
   const [joinRoomId, setJoinRoomId] = useState('');
+  const [timeControl, setTimeControl] = useState('unlimited');
   const navigate = useNavigate();
   const { user, logout } = useAuth();
 
   const [csrfToken, setCsrfToken] = useState(null); 
+  const [searching, setSearching] = useState(false);
+  const matchSocket = useRef(null);
+
+  useEffect(() => () => matchSocket.current && matchSocket.current.close(), []);
 
   useEffect(() => {
     const fetchCsrfToken = async () => {
@@ -32,7 +45,8 @@ const HomePage = () => {
       return;
     }
     try {
-      const response = await axios.post('/api/create-room/', {}, {
+      const selected = TIME_CONTROLS[timeControl];
+      const response = await axios.post('/api/create-room/', selected ? { time_control: selected } : {}, {
           headers: { 'X-CSRFToken': csrfToken }
       });
       if (response.data && response.data.room_id) {
@@ -43,6 +57,52 @@ const HomePage = () => {
     }
   };
 
+  const handleFindMatch = () => {
+    if (searching) {
+      matchSocket.current.close();
+      setSearching(false);
+      return;
+    }
+
+    const socket = new WebSocket('ws://localhost:8000/ws/matchmaking/');
+    socket.onopen = () => {
+      const selected = TIME_CONTROLS[timeControl];
+      socket.send(JSON.stringify({ type: 'join_queue', time_control: selected }));
+    };
+    socket.onmessage = (e) => {
+      const data = JSON.parse(e.data);
+      if (data.type === 'match_found') {
+        socket.close();
+        navigate(`/match/${data.room_id}`);
+      } else if (data.type === 'error') {
+        console.error('Matchmaking error:', data.message);
+        socket.close();
+      }
+    };
+    socket.onclose = () => setSearching(false);
+    matchSocket.current = socket;
+    setSearching(true);
+  };
+
+  const handlePlayBot = async () => {
+    if (!csrfToken) {
+      console.error("CSRF token not available.");
+      return;
+    }
+    try {
+      const selected = TIME_CONTROLS[timeControl];
+      const body = selected ? { opponent: 'bot', time_control: selected } : { opponent: 'bot' };
+      const response = await axios.post('/api/create-room/', body, {
+          headers: { 'X-CSRFToken': csrfToken }
+      });
+      if (response.data && response.data.room_id) {
+        navigate(`/match/${response.data.room_id}`);
+      }
+    } catch (error) {
+      console.error('Error starting a game against the computer:', error.response ? error.response.data : error.message);
+    }
+  };
+
   const handleJoinRoom = async (e) => {
     e.preventDefault();
     if (!csrfToken) {
@@ -74,6 +134,9 @@ const HomePage = () => {
                         Welcome, <strong>{user.username}</strong>
                     </span>
                 )}
+                <a href="/api/export-pgn/" className="logout-btn" download>
+                    Download my games
+                </a>
                 <button onClick={logout} className="logout-btn">
                     Logout
                 </button>
@@ -84,6 +147,17 @@ const HomePage = () => {
 
               <div className="game-options-card">
                   <form onSubmit={handleCreateRoom}>
+                      <select
+                          value={timeControl}
+                          onChange={(e) => setTimeControl(e.target.value)}
+                          className="input-field"
+                      >
+                          {Object.keys(TIME_CONTROLS).map((key) => (
+                              <option key={key} value={key}>
+                                  {key === 'unlimited' ? 'No clock' : key}
+                              </option>
+                          ))}
+                      </select>
                       <button
                           type="submit"
                           className="action-btn"
@@ -91,6 +165,21 @@ const HomePage = () => {
                       >
                           {csrfToken ? "Create New Game" : "Loading..."}
                       </button>
+                      <button
+                          type="button"
+                          className="action-btn"
+                          onClick={handlePlayBot}
+                          disabled={!csrfToken}
+                      >
+                          Play the Computer
+                      </button>
+                      <button
+                          type="button"
+                          className="action-btn"
+                          onClick={handleFindMatch}
+                      >
+                          {searching ? "Searching... (cancel)" : "Find a Match"}
+                      </button>
                   </form>
 
                   <div className="divider">OR</div>
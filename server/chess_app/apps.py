@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ChessAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chess_app'
+
+    def ready(self):
+        # installs the query timer before any database connection is opened
+        from . import metrics  # noqa: F401
+        # connects the signals that drop cached users
+        from . import auth  # noqa: F401
@@ -0,0 +1,97 @@
+from channels.auth import AuthMiddleware
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
+
+UNCACHED_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+def user_cache_key(user_id):
+    return f'user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    # Resolves the user behind a session from the cache, so HTTP requests
+    # and WebSocket connects (Channels' AuthMiddleware calls this backend
+    # too) skip the users table. Logging in works as in ModelBackend.
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.USER_CACHE_TTL)
+        return user
+
+    async def aget_user(self, user_id):
+        # Async views resolve the user through here instead.
+        key = user_cache_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await cache.aset(key, user, settings.USER_CACHE_TTL)
+        return user
+
+
+# Sessions signed in before CachedModelBackend name ModelBackend, which is
+# no longer listed, so Django would sign them out. They are switched over
+# the first time they are seen again: by UpgradeSessionMiddleware on HTTP
+# requests, ahead of AuthenticationMiddleware, and by
+# UpgradeSessionSocketMiddleware on WebSocket connects.
+
+def upgrade_session(session):
+    if UNCACHED_BACKEND in settings.AUTHENTICATION_BACKENDS:
+        return False
+    if session.get(BACKEND_SESSION_KEY) != UNCACHED_BACKEND:
+        return False
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    return True
+
+
+class UpgradeSessionMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        upgrade_session(request.session)
+
+
+class UpgradeSessionSocketMiddleware(BaseMiddleware):
+    async def __call__(self, scope, receive, send):
+        await self.upgrade(scope['session'])
+        return await super().__call__(scope, receive, send)
+
+    @database_sync_to_async
+    def upgrade(self, session):
+        # sockets have no response to save the session with
+        if upgrade_session(session):
+            session.save()
+
+
+def auth_middleware_stack(inner):
+    # Channels' AuthMiddlewareStack with the session upgrade in front of the
+    # user lookup.
+    return CookieMiddleware(SessionMiddleware(UpgradeSessionSocketMiddleware(AuthMiddleware(inner))))
+
+
+# Any save of the user drops the cached copy: a password change, so old
+# session hashes stop matching at once, deactivation and the last_login
+# update made on every login. Logging out drops it as well.
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def forget_saved_user(sender, instance, **kwargs):
+    cache.delete(user_cache_key(instance.pk))
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        cache.delete(user_cache_key(user.pk))
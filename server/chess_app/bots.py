@@ -0,0 +1,60 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import chess
+from django.conf import settings
+from . import metrics
+from .engine import search
+
+
+class BotsBusy(Exception):
+    pass
+
+
+class BotPool:
+    # Runs engine searches in worker processes so a search never holds the
+    # event loop. At most `workers` searches run at once and at most
+    # `queue_size` more wait for a worker; new bot games are refused while
+    # the queue is full, moves in running games wait their turn.
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.pending = 0
+        self._executor = None
+        self._slots = None
+
+    def busy(self):
+        return self.pending >= self.capacity
+
+    async def best_move(self, moves, time_limit):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        self.pending += 1
+        metrics.bot_searches.set(value=self.pending)
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor, search, chess.STARTING_FEN, moves, time_limit, settings.BOT_UCI_ENGINE,
+                )
+        except BrokenProcessPool:
+            # a worker died; later searches get a fresh pool
+            self._executor = None
+            raise
+        finally:
+            self.pending -= 1
+            metrics.bot_searches.set(value=self.pending)
+
+    def move_time(self, clock, color):
+        # Spend the configured time per move, or less when the bot's own
+        # clock would not last the game at that pace.
+        if clock is None:
+            return settings.BOT_MOVE_TIME
+        return max(min(settings.BOT_MOVE_TIME, clock.remaining[color] / 40), 0.05)
+
+
+bots = BotPool(settings.BOT_WORKERS, settings.BOT_QUEUE_SIZE)
@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import time
+
+MAX_BASE_TIME = 3 * 60 * 60
+MAX_INCREMENT = 180
+
+
+def parse_time_control(data):
+    time_control = data.get('time_control') if isinstance(data, dict) else None
+    if time_control is None:
+        return None, 0
+    if not isinstance(time_control, dict):
+        raise ValueError('Invalid time control.')
+
+    base = time_control.get('base')
+    increment = time_control.get('increment', 0)
+    if not isinstance(base, int) or not isinstance(increment, int):
+        raise ValueError('Time control base and increment must be whole seconds.')
+    if not 0 < base <= MAX_BASE_TIME or not 0 <= increment <= MAX_INCREMENT:
+        raise ValueError('Time control is out of range.')
+    return base, increment
+
+
+class Clock:
+    # Remaining time for both sides in seconds. The clock of the side to move
+    # starts running once white has made the first move.
+
+    def __init__(self, base, increment, move_times=()):
+        self.increment = increment
+        self.remaining = {'white': float(base), 'black': float(base)}
+        self.turn_started = None
+        self.ply = 0
+        for played_at in move_times:
+            self.press(played_at)
+
+    @property
+    def turn(self):
+        return 'white' if self.ply % 2 == 0 else 'black'
+
+    def time_left(self, color, now):
+        remaining = self.remaining[color]
+        if color == self.turn and self.turn_started is not None:
+            remaining -= now - self.turn_started
+        return remaining
+
+    def deadline(self):
+        if self.turn_started is None:
+            return None
+        return self.turn_started + self.remaining[self.turn]
+
+    def is_expired(self, now):
+        return self.time_left(self.turn, now) <= 0
+
+    def press(self, now):
+        color = self.turn
+        self.remaining[color] = self.time_left(color, now) + self.increment
+        self.turn_started = now
+        self.ply += 1
+
+    def state(self, now):
+        return {
+            'white': round(max(self.time_left('white', now), 0), 3),
+            'black': round(max(self.time_left('black', now), 0), 3),
+            'running': self.turn if self.turn_started is not None else None,
+        }
+
+
+class ClockScheduler:
+    # One timer for every clock in the process. Deadlines (epoch seconds) sit
+    # in a heap; a single loop.call_at handle is armed for the earliest one.
+    # Rescheduling or cancelling a key leaves its old heap entry behind, and
+    # stale entries are skipped when they reach the top.
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._timer = None
+        self._timer_deadline = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, key, deadline, callback):
+        self._deadlines[key] = (deadline, callback)
+        heapq.heappush(self._heap, (deadline, key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, key) for key, (deadline, _) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        self._arm()
+
+    def cancel(self, key):
+        if self._deadlines.pop(key, None) is not None:
+            self._arm()
+
+    def _is_current(self, entry):
+        deadline, key = entry
+        current = self._deadlines.get(key)
+        return current is not None and current[0] == deadline
+
+    def _arm(self):
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+
+        loop = asyncio.get_running_loop()
+        if not self._heap:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return
+
+        deadline = self._heap[0][0]
+        if self._timer is not None and self._loop is loop and self._timer_deadline <= deadline:
+            return
+
+        if self._timer is not None:
+            self._timer.cancel()
+        self._loop = loop
+        self._timer_deadline = deadline
+        self._timer = loop.call_at(loop.time() + max(deadline - time.time(), 0), self._fire)
+
+    def _fire(self):
+        self._timer = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+            _, callback = self._deadlines.pop(entry[1])
+            asyncio.ensure_future(callback())
+        self._arm()
+
+
+scheduler = ClockScheduler()
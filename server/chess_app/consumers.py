@@ -1,11 +1,68 @@
-import json
-import chess
+import random
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from .models import Game
+from . import metrics, protocol
+from .clocks import parse_time_control
+from .matchmaking import matchmaker
+from .ratelimit import MessageLimiter
+from .ratings import acurrent_rating
+from .rooms import rooms
+from .store import store
+
+
+class FrameConsumer(AsyncWebsocketConsumer):
+    # Speaks JSON text, or msgpack binary frames when the client offers the
+    # msgpack subprotocol. Handlers see decoded dicts either way, and only
+    # once the socket's limit for that message type allows it.
+    limiter = None
+
+    @property
+    def wire_format(self):
+        # known from the handshake, before the socket is accepted
+        return 'msgpack' if protocol.SUBPROTOCOL in self.scope.get('subprotocols', []) else 'json'
+
+    async def accept_client(self):
+        if self.wire_format == 'msgpack':
+            await self.accept(protocol.SUBPROTOCOL)
+        else:
+            await self.accept()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            data = protocol.decode(bytes_data, 'msgpack')
+        else:
+            data = protocol.decode(text_data, 'json')
+
+        if self.allow(data.get('type')):
+            await self.receive_message(data)
 
+    def allow(self, message_type):
+        if self.limiter is None:
+            self.limiter = MessageLimiter()
+        if self.limiter.allow(message_type):
+            return True
+        metrics.dropped_messages.inc(self.limiter.kind(message_type) or 'other')
+        return False
+
+    async def receive_message(self, data):
+        pass
+
+    async def send_event(self, event):
+        await self.send_encoded(protocol.encode(event, self.wire_format))
+
+    async def send_encoded(self, payload):
+        if self.wire_format == 'msgpack':
+            await self.send(bytes_data=payload)
+        else:
+            await self.send(text_data=payload)
+
+    async def send_frame(self, event):
+        await self.send_encoded(protocol.frame_payload(event, self.wire_format))
+
+
+class LobbyConsumer(FrameConsumer):
+    MAX_WRITE_ATTEMPTS = 3
 
-class LobbyConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'lobby_{self.room_id}'
@@ -16,37 +73,56 @@ class LobbyConsumer(AsyncWebsocketConsumer):
             return
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept_client()
+        metrics.connections.inc('lobby')
+        self.counted = True
         await self.broadcast_lobby_state()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if getattr(self, 'counted', False):
+            metrics.connections.dec('lobby')
+            self.counted = False
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive_message(self, data):
         if data.get('type') == 'player_ready':
-            await self.handle_player_ready()
+            with metrics.track_handler('handle_player_ready'):
+                await self.handle_player_ready()
 
     async def handle_player_ready(self):
-        game = await self.get_game(self.room_id)
-        if self.user == game.white_player:
-            game.white_player_ready = True
-        elif self.user == game.black_player:
-            game.black_player_ready = True
-
-        if game.white_player_ready and game.black_player_ready:
-            import random
-            if random.choice([True, False]):
-                game.white_player, game.black_player = game.black_player, game.white_player
-                game.white_player_ready, game.black_player_ready = game.black_player_ready, game.white_player_ready
+        for _ in range(self.MAX_WRITE_ATTEMPTS):
+            game = await store.load_game(self.room_id)
+            if not game:
+                return
+
+            if self.user == game.white_player:
+                changes = {'white_player_ready': True}
+            elif self.user == game.black_player:
+                changes = {'black_player_ready': True}
+            else:
+                return
+
+            white_ready = changes.get('white_player_ready', game.white_player_ready)
+            black_ready = changes.get('black_player_ready', game.black_player_ready)
+            if white_ready and black_ready and game.status == 'waiting':
+                if random.choice([True, False]):
+                    changes['white_player'] = game.black_player
+                    changes['black_player'] = game.white_player
+                changes['status'] = 'playing'
+
+            if await store.update_game(game, **changes):
+                break
+        else:
+            return
 
-            game.status = 'playing'
+        room = rooms.get(self.room_id)
+        if room is not None:
+            room.sync_from(game)
 
-        await game.asave()
         await self.broadcast_lobby_state()
 
     async def broadcast_lobby_state(self):
-        game = await self.get_game(self.room_id)
+        game = await store.load_game(self.room_id)
         if not game:
             return
 
@@ -57,91 +133,125 @@ class LobbyConsumer(AsyncWebsocketConsumer):
             'whitePlayerReady': game.white_player_ready,
             'blackPlayerReady': game.black_player_ready,
         }
-        await self.channel_layer.group_send(self.room_group_name, state)
+        await metrics.group_send(self.channel_layer, self.room_group_name, protocol.frame(state))
+
 
-    async def lobby_state_update(self, event):
-        await self.send(text_data=json.dumps(event))
+class RoomConsumer(FrameConsumer):
+    # A socket on a live room. On connect, and when asked with a resume
+    # message, it is brought up to date on its own: with just the events
+    # it missed when the client says which ply it saw last (?since=<ply> on
+    # the URL), or with a full snapshot otherwise.
 
-    @database_sync_to_async
-    def get_game(self, room_id):
+    def since_ply(self):
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get('since')
         try:
-            return Game.objects.select_related('white_player', 'black_player').get(room_id=room_id)
-        except Game.DoesNotExist:
+            return int(values[0])
+        except (TypeError, ValueError):
             return None
-        
 
-class ChessConsumer(AsyncWebsocketConsumer):
+    async def resume(self, ply):
+        await self.room.catch_up()
+        events = self.room.events_since(ply)
+        if events is None:
+            metrics.resumes.inc('snapshot')
+            await self.send_snapshot()
+            return
+
+        metrics.resumes.inc('replay')
+        for event in events:
+            await self.send_event(event)
+
+    async def send_snapshot(self):
+        await self.send_event({'type': 'game_state_update', **self.room.snapshot()})
+
+
+class ChessConsumer(RoomConsumer):
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'game_{self.room_id}'
         self.user = self.scope['user']
+        self.room = None
 
         if not self.user.is_authenticated:
             await self.close()
             return
 
-        game = await self.get_game(self.room_id)
-        if game is None or (self.user != game.white_player and self.user != game.black_player):
+        room = await rooms.acquire(self.room_id)
+        if room is None:
             await self.close()
             return
-        
-        if game.status == 'finished':
+
+        # Players may still join a finished game: a socket that dropped
+        # before the end gets the last moves and the result this way.
+        if room.color_of(self.user) is None:
+            await rooms.release(room)
             await self.close()
             return
-        
+
+        self.room = room
+        self.player_color = room.color_of(self.user)
+        # counted before joining the group, so no broadcast leaves our
+        # format out
+        room.formats[self.wire_format] += 1
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_client()
+        metrics.connections.inc('match')
 
-        await self.broadcast_game_state()
+        await self.resume(self.since_ply())
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        if self.room is not None:
+            metrics.connections.dec('match')
+            self.room.formats[self.wire_format] -= 1
+            await rooms.release(self.room)
+            self.room = None
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive_message(self, data):
         message_type = data.get('type')
         handler = getattr(self, f'handle_{message_type}', None)
         if handler:
-            await handler(data)
+            with metrics.track_handler(handler.__name__):
+                await handler(data)
 
     async def handle_move(self, data):
-        game = await self.get_game(self.room_id)
-        if not game or game.status != 'playing':
-            return
+        room = self.room
+        move_uci = data.get('from', '') + data.get('to', '') + data.get('promotion', '')
 
-        board = chess.Board(game.fen_position)
+        await room.catch_up()
+        if room.status != 'playing' or room.color_of(self.user) != room.turn:
+            return
 
-        is_white_turn = board.turn == chess.WHITE
-        is_black_turn = board.turn == chess.BLACK
+        if room.clock_expired():
+            await room.check_flag()
+            return
 
-        if (is_white_turn and self.user != game.white_player) or \
-           (is_black_turn and self.user != game.black_player):
-            return 
+        if not await room.make_move(self.user, move_uci):
+            await self.send_event({'type': 'error', 'message': 'Illegal move'})
 
-        move_uci = data.get('from', '') + data.get('to', '')
-        move = chess.Move.from_uci(move_uci)
+    async def handle_resync(self, data):
+        await self.room.catch_up()
+        await self.send_snapshot()
 
-        if move in board.legal_moves:
-            board.push(move)
-            game.fen_position = board.fen()
-            game.moves.append(move_uci)
-            
-            if board.is_checkmate() or board.is_stalemate() or board.is_insufficient_material():
-                game.status = 'finished'
+    async def handle_resume(self, data):
+        await self.resume(data.get('ply'))
 
-            await game.asave()
-            await self.broadcast_game_state()
-        else:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Illegal move'}))
+    async def send_snapshot(self):
+        await self.send_event({
+            'type': 'game_state_update',
+            **self.room.snapshot(),
+            'player_color': self.player_color,
+        })
 
     async def handle_chat_message(self, data):
-        await self.channel_layer.group_send(
+        await metrics.group_send(
+            self.channel_layer,
             self.room_group_name,
             {
                 'type': 'chat.message',
@@ -151,7 +261,8 @@ class ChessConsumer(AsyncWebsocketConsumer):
         )
 
     async def handle_video_signal(self, data):
-        await self.channel_layer.group_send(
+        await metrics.group_send(
+            self.channel_layer,
             self.room_group_name,
             {
                 'type': 'video.signal',
@@ -160,54 +271,93 @@ class ChessConsumer(AsyncWebsocketConsumer):
             }
         )
 
-    async def broadcast_game_state(self):
-        game = await self.get_game(self.room_id)
-        if not game:
-            return
-
-        game_state = {
-            'type': 'game_state_update',
-            'white_player': game.white_player.username if game.white_player else None,
-            'black_player': game.black_player.username if game.black_player else None,
-            'fen': game.fen_position,
-            'status': game.status,
-            'moves': game.moves,
-        }
-        await self.channel_layer.group_send(
-            self.room_group_name, game_state
-        )
-
-    async def game_state_update(self, event):
-        player_color = None
-        if self.user == await self.get_white_player(self.room_id):
-            player_color = 'white'
-        elif self.user == await self.get_black_player(self.room_id):
-            player_color = 'black'
-        
-        event['player_color'] = player_color
-        await self.send(text_data=json.dumps(event))
-
     async def chat_message(self, event):
         if self.user.username != event['sender']:
             event['type'] = 'chat_message'
-            await self.send(text_data=json.dumps(event))
+            await self.send_event(event)
 
     async def video_signal(self, event):
         if self.user.username != event['sender']:
             event['type'] = 'video_signal'
-            await self.send(text_data=json.dumps(event))
+            await self.send_event(event)
+
+
+class SpectatorConsumer(RoomConsumer):
+    # Read-only view of a game. Spectators get the same pre-encoded frames
+    # as the players and may only ask for a resync or resume.
+
+    async def connect(self):
+        self.room_id = self.scope['url_route']['kwargs']['room_id']
+        self.room_group_name = f'watch_{self.room_id}'
+        self.room = None
+
+        room = await rooms.acquire(self.room_id)
+        if room is None:
+            await self.close()
+            return
 
-    @database_sync_to_async
-    def get_game(self, room_id):
+        self.room = room
+        room.spectators += 1
+        room.formats[self.wire_format] += 1
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept_client()
+        metrics.connections.inc('watch')
+        await self.resume(self.since_ply())
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.room is not None:
+            metrics.connections.dec('watch')
+            self.room.spectators -= 1
+            self.room.formats[self.wire_format] -= 1
+            await rooms.release(self.room)
+            self.room = None
+
+    async def receive_message(self, data):
+        if data.get('type') == 'resync':
+            with metrics.track_handler('handle_watch_resync'):
+                await self.room.catch_up()
+                await self.send_snapshot()
+        elif data.get('type') == 'resume':
+            with metrics.track_handler('handle_watch_resume'):
+                await self.resume(data.get('ply'))
+
+
+class MatchmakingConsumer(FrameConsumer):
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        await self.accept_client()
+        metrics.connections.inc('matchmaking')
+        self.counted = True
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'counted', False):
+            matchmaker.leave(self.user)
+            metrics.connections.dec('matchmaking')
+            self.counted = False
+
+    async def receive_message(self, data):
+        if data.get('type') == 'join_queue':
+            with metrics.track_handler('handle_join_queue'):
+                await self.handle_join_queue(data)
+        elif data.get('type') == 'leave_queue':
+            matchmaker.leave(self.user)
+
+    async def handle_join_queue(self, data):
         try:
-            return Game.objects.select_related('white_player', 'black_player').get(room_id=room_id)
-        except Game.DoesNotExist:
-            return None
+            time_control = parse_time_control(data)
+        except ValueError as e:
+            await self.send_event({'type': 'error', 'message': str(e)})
+            return
 
-    async def get_white_player(self, room_id):
-        game = await self.get_game(room_id)
-        return game.white_player if game else None
+        rating = await acurrent_rating(self.user)
+        await self.send_event({'type': 'queue_joined', 'rating': rating})
+        await matchmaker.join(self.user, rating, self.channel_name, time_control)
 
-    async def get_black_player(self, room_id):
-        game = await self.get_game(room_id)
-        return game.black_player
\ No newline at end of file
+    async def match_found(self, event):
+        event['type'] = 'match_found'
+        await self.send_event(event)
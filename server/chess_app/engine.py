@@ -0,0 +1,171 @@
+import time
+import chess
+import chess.engine
+import chess.polyglot
+
+# Move search for the computer opponent. This module runs in the bot worker
+# processes, so it must not depend on Django.
+
+PIECE_VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 320,
+    chess.BISHOP: 330,
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+    chess.KING: 0,
+}
+
+# Bonus for each square from white's side, a1 first. Black uses the mirror.
+CENTER_BONUS = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 5, 5, 5, 5, 5, 5, 0,
+    0, 5, 10, 10, 10, 10, 5, 0,
+    0, 5, 10, 20, 20, 10, 5, 0,
+    0, 5, 10, 20, 20, 10, 5, 0,
+    0, 5, 10, 10, 10, 10, 5, 0,
+    0, 5, 5, 5, 5, 5, 5, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+
+MATE = 100000
+EXACT, LOWER, UPPER = 0, 1, 2
+MAX_DEPTH = 64
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def evaluate(board):
+    # Material plus a little for central minor pieces and pawns, from the
+    # side to move's point of view.
+    score = 0
+    for square, piece in board.piece_map().items():
+        value = PIECE_VALUES[piece.piece_type]
+        if piece.piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP):
+            value += CENTER_BONUS[square if piece.color == chess.WHITE else chess.square_mirror(square)]
+        score += value if piece.color == chess.WHITE else -value
+    return score if board.turn == chess.WHITE else -score
+
+
+def ordered_moves(board, best=None):
+    # Best move from the table first, then captures of the most valuable
+    # pieces, then the rest.
+    def priority(move):
+        if move == best:
+            return -MATE
+        victim = board.piece_type_at(move.to_square)
+        return -PIECE_VALUES[victim] if victim else 0
+    return sorted(board.legal_moves, key=priority)
+
+
+class Searcher:
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.table = {}
+        self.nodes = 0
+
+    def check_time(self):
+        self.nodes += 1
+        if self.nodes % 1024 == 0 and time.monotonic() > self.deadline:
+            raise SearchTimeout
+
+    def quiesce(self, board, alpha, beta):
+        self.check_time()
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return beta
+        alpha = max(alpha, stand_pat)
+        for move in ordered_moves(board):
+            if not board.is_capture(move):
+                continue
+            board.push(move)
+            score = -self.quiesce(board, -beta, -alpha)
+            board.pop()
+            if score >= beta:
+                return beta
+            alpha = max(alpha, score)
+        return alpha
+
+    def negamax(self, board, depth, alpha, beta, ply):
+        self.check_time()
+        if board.is_checkmate():
+            return -MATE + ply
+        if board.is_stalemate() or board.is_insufficient_material():
+            return 0
+        if board.is_repetition(2) or board.halfmove_clock >= 100:
+            return 0
+        if depth == 0:
+            return self.quiesce(board, alpha, beta)
+
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self.table.get(key)
+        best = None
+        if entry is not None:
+            entry_depth, flag, value, best = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWER and value >= beta:
+                    return value
+                if flag == UPPER and value <= alpha:
+                    return value
+
+        original_alpha = alpha
+        best_score = -MATE
+        for move in ordered_moves(board, best):
+            board.push(move)
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.pop()
+            if score > best_score:
+                best_score, best = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = (depth, flag, best_score, best)
+        return best_score
+
+    def search_root(self, board, depth, previous):
+        # The root is searched move by move rather than through negamax, so
+        # a root position that already occurred (scored as a draw before
+        # any move is tried) still yields a move.
+        alpha, best = -MATE - 1, None
+        for move in ordered_moves(board, previous):
+            board.push(move)
+            score = -self.negamax(board, depth - 1, -MATE - 1, -alpha, 1)
+            board.pop()
+            if best is None or score > alpha:
+                alpha, best = score, move
+        return best
+
+    def best_move(self, board):
+        # Iterative deepening: each finished depth puts its best move first
+        # for the next one, and the last finished depth wins.
+        best = next(iter(board.legal_moves))
+        try:
+            for depth in range(1, MAX_DEPTH + 1):
+                best = self.search_root(board, depth, best)
+        except SearchTimeout:
+            pass
+        return best
+
+
+def search(fen, moves, time_limit, uci_path=None):
+    # Entry point for the worker processes. moves are replayed onto the
+    # position so repetitions are seen. Returns the chosen move as UCI.
+    board = chess.Board(fen)
+    for uci in moves:
+        board.push_uci(uci)
+
+    if uci_path:
+        with chess.engine.SimpleEngine.popen_uci(uci_path) as engine:
+            return engine.play(board, chess.engine.Limit(time=time_limit)).move.uci()
+
+    return Searcher(time.monotonic() + time_limit).best_move(board).uci()
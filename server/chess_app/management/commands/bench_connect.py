@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+import uuid
+from importlib import import_module
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from chess_app import metrics
+from chess_app.auth import auth_middleware_stack, user_cache_key
+from chess_app.routing import websocket_urlpatterns
+
+# What authenticating a socket cost before sessions and users were cached.
+UNCACHED = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure authenticated WebSocket connects per second with and without the session and user cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users connecting at once.')
+        parser.add_argument('--rounds', type=int, default=5,
+                            help='Times every user reconnects, as after a deploy.')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:6]
+        users = [User.objects.create_user(username=f'bc-{tag}-{index}') for index in range(options['users'])]
+        report = {}
+        # Only keys this run made are touched: the cache is shared with
+        # the live site's sessions, rate limits and leaderboard.
+        self.sessions = []
+        try:
+            with override_settings(**UNCACHED):
+                report['uncached'] = self.measure(users, options['rounds'])
+            cache.delete_many([user_cache_key(user.pk) for user in users])
+            report['cached'] = self.measure(users, options['rounds'])
+        finally:
+            for session in self.sessions:
+                session.delete()
+            User.objects.filter(username__startswith=f'bc-{tag}-').delete()
+
+        report.update({
+            'users': options['users'],
+            'rounds': options['rounds'],
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'cache': settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1],
+        })
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+    def measure(self, users, rounds):
+        # The same middleware stack as asgi.py, built here so that the
+        # overridden settings are the ones it reads.
+        application = auth_middleware_stack(URLRouter(websocket_urlpatterns))
+        sessions = [self.login(user) for user in users]
+
+        queries_before = metrics.db_queries.values.get((), 0)
+        started = time.perf_counter()
+        connects = async_to_sync(self.run)(application, sessions, rounds)
+        elapsed = time.perf_counter() - started
+        queries = metrics.db_queries.values.get((), 0) - queries_before
+
+        return {
+            'connects': connects,
+            'duration_s': round(elapsed, 3),
+            'connects_per_sec': round(connects / elapsed, 1) if elapsed else None,
+            'queries_per_connect': round(queries / connects, 3) if connects else None,
+        }
+
+    def login(self, user):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        self.sessions.append(session)
+        return session.session_key
+
+    async def run(self, application, sessions, rounds):
+        connects = 0
+        for _ in range(rounds):
+            results = await asyncio.gather(*(self.connect(application, key) for key in sessions))
+            connects += sum(results)
+        return connects
+
+    async def connect(self, application, session_key):
+        communicator = WebsocketCommunicator(
+            application, '/ws/matchmaking/',
+            headers=[(b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode())],
+        )
+        connected, _ = await communicator.connect()
+        await communicator.disconnect()
+        return int(connected)
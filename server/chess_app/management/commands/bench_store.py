@@ -0,0 +1,68 @@
+import asyncio
+import time
+import uuid
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from chess_app.models import Game, Move
+from chess_app.store import OrmGameStore, PsycopgGameStore, create_store
+
+# Knights out and back: always legal, so any number of moves can be played.
+SHUFFLE = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent move throughput of the ORM and async psycopg game stores.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=50, help='Games played concurrently.')
+        parser.add_argument('--moves', type=int, default=40, help='Moves written per game.')
+        parser.add_argument('--pool-size', type=int, default=10, help='Connections in the psycopg pool.')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        white = User.objects.create_user(username=f'bench-white-{tag}')
+        black = User.objects.create_user(username=f'bench-black-{tag}')
+        games = [
+            Game(room_id=f'b{tag[:3]}{index:04d}', white_player=white, black_player=black, status='playing')
+            for index in range(options['games'])
+        ]
+        Game.objects.bulk_create(games)
+
+        stores = [('orm', OrmGameStore())]
+        psycopg_store = create_store(options['pool_size'])
+        if isinstance(psycopg_store, PsycopgGameStore):
+            stores.append(('psycopg', psycopg_store))
+        else:
+            self.stdout.write('psycopg: skipped, the default database is not PostgreSQL or --pool-size is 0')
+
+        try:
+            for name, store in stores:
+                Move.objects.filter(game__in=games).delete()
+                Game.objects.filter(pk__in=[game.pk for game in games]).update(version=0)
+
+                elapsed = async_to_sync(self.run)(store, games, options['moves'])
+                total = len(games) * options['moves']
+                self.stdout.write(f'{name}: {total} moves in {elapsed:.2f}s ({total / elapsed:.0f} moves/s)')
+        finally:
+            Game.objects.filter(pk__in=[game.pk for game in games]).delete()
+            white.delete()
+            black.delete()
+
+    async def run(self, store, games, moves):
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(self.play(store, game.room_id, moves) for game in games))
+        finally:
+            if hasattr(store, 'close'):
+                await store.close()
+        return time.perf_counter() - started
+
+    async def play(self, store, room_id, moves):
+        game = await store.load_game(room_id)
+        version = game.version
+        for ply in range(1, moves + 1):
+            uci = SHUFFLE[(ply - 1) % len(SHUFFLE)]
+            move = Move(game_id=game.pk, ply=ply, uci=uci)
+            await store.append_moves(game.pk, version, {'fen_position': game.fen_position}, [move])
+            version += 1
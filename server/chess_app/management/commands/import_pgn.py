@@ -0,0 +1,218 @@
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+import chess
+import chess.pgn
+import chess.polyglot
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from chess_app.models import Game, GamePosition, Move, generate_room_id
+from chess_app.positions import signed_key
+
+RESULTS = {'1-0', '0-1', '1/2-1/2'}
+USERNAME_LENGTH = User._meta.get_field('username').max_length
+TERMINATION_LENGTH = Game._meta.get_field('termination').max_length
+
+
+def read_games(lines):
+    # Splits a PGN stream into the text of each game without parsing it, so
+    # the parsing can be spread over the worker processes.
+    game = []
+    in_movetext = False
+    for line in lines:
+        if line.startswith('[') and in_movetext:
+            yield ''.join(game)
+            game = []
+            in_movetext = False
+        if line.strip() and not line.startswith('['):
+            in_movetext = True
+        game.append(line)
+    if in_movetext:
+        yield ''.join(game)
+
+
+def player_name(headers, color):
+    name = headers.get(color, '').strip()
+    return name[:USERNAME_LENGTH] if name and name != '?' else None
+
+
+def game_date(headers):
+    # When the game was played, from UTCDate/UTCTime or else Date. Dates
+    # with unknown parts ('2013.??.??') are treated as missing.
+    for date_key, time_key in (('UTCDate', 'UTCTime'), ('Date', None)):
+        try:
+            played = datetime.strptime(headers.get(date_key, ''), '%Y.%m.%d')
+        except ValueError:
+            continue
+        try:
+            clock = datetime.strptime(headers.get(time_key) or '', '%H:%M:%S').time()
+            played = datetime.combine(played.date(), clock)
+        except ValueError:
+            pass
+        return played.replace(tzinfo=dt_timezone.utc)
+    return None
+
+
+def parse_game(text):
+    # Runs in a worker process. Returns None for games that cannot be
+    # imported: unfinished, from a custom position, or with illegal moves.
+    game = chess.pgn.read_game(io.StringIO(text))
+    if game is None or game.errors:
+        return None
+
+    headers = game.headers
+    result = headers.get('Result')
+    if result not in RESULTS or 'FEN' in headers or headers.get('Variant', 'Standard').lower() != 'standard':
+        return None
+
+    board = game.board()
+    moves = []
+    positions = []
+    for move in game.mainline_moves():
+        moves.append(move.uci())
+        board.push(move)
+        positions.append(signed_key(chess.polyglot.zobrist_hash(board)))
+
+    termination = headers.get('Termination', '').strip().lower().replace(' ', '_')
+    if board.is_checkmate():
+        termination = 'checkmate'
+    elif board.is_stalemate():
+        termination = 'stalemate'
+
+    return {
+        'white': player_name(headers, 'White'),
+        'black': player_name(headers, 'Black'),
+        'result': result,
+        'termination': termination[:TERMINATION_LENGTH],
+        'fen': board.fen(),
+        'played_at': game_date(headers),
+        'moves': moves,
+        'positions': positions,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Import finished games from PGN files, validating moves in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='PGN files to import.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Games parsed and inserted together.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Parser processes. 0 parses in this process.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        self.workers = options['workers']
+        pool = ProcessPoolExecutor(self.workers) if self.workers > 0 else None
+        imported = skipped = 0
+        started = time.perf_counter()
+        try:
+            for path in options['paths']:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    batch = []
+                    for text in read_games(f):
+                        batch.append(text)
+                        if len(batch) == batch_size:
+                            count = self.import_batch(batch, pool)
+                            imported += count
+                            skipped += len(batch) - count
+                            batch = []
+                    if batch:
+                        count = self.import_batch(batch, pool)
+                        imported += count
+                        skipped += len(batch) - count
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(f'Imported {imported} games, skipped {skipped}, in {elapsed:.1f}s ({rate:.0f} games/s)')
+
+    def import_batch(self, texts, pool):
+        if pool is not None:
+            chunksize = max(len(texts) // (self.workers * 4), 1)
+            parsed = [game for game in pool.map(parse_game, texts, chunksize=chunksize) if game]
+        else:
+            parsed = [game for game in map(parse_game, texts) if game]
+        if not parsed:
+            return 0
+
+        with transaction.atomic():
+            users = self.resolve_users({name for game in parsed for name in (game['white'], game['black']) if name})
+            room_ids = self.new_room_ids(len(parsed))
+            games = Game.objects.bulk_create([
+                Game(
+                    room_id=room_id,
+                    white_player=users.get(game['white']),
+                    black_player=users.get(game['black']),
+                    status='finished',
+                    white_player_ready=True,
+                    black_player_ready=True,
+                    fen_position=game['fen'],
+                    result=game['result'],
+                    termination=game['termination'],
+                )
+                for room_id, game in zip(room_ids, parsed)
+            ])
+            # created_at is set to now on insert, so the PGN dates are
+            # written over it. updated_at stays the import time, which keeps
+            # reap_games from archiving old games as soon as they arrive.
+            now = timezone.now()
+            dated = []
+            for row, game in zip(games, parsed):
+                if game['played_at'] is not None:
+                    row.created_at = game['played_at']
+                    dated.append(row)
+            Game.objects.bulk_update(dated, ['created_at'], batch_size=1000)
+            self.insert_rows(Move, ['game_id', 'ply', 'uci', 'played_at'], [
+                (row.pk, ply, uci, game['played_at'] or now)
+                for row, game in zip(games, parsed)
+                for ply, uci in enumerate(game['moves'], start=1)
+            ])
+            self.insert_rows(GamePosition, ['game_id', 'ply', 'zobrist'], [
+                (row.pk, ply, zobrist)
+                for row, game in zip(games, parsed)
+                for ply, zobrist in enumerate(game['positions'], start=1)
+            ])
+        return len(games)
+
+    def resolve_users(self, names):
+        users = {user.username: user for user in User.objects.filter(username__in=names)}
+        missing = [User(username=name) for name in names if name not in users]
+        for user in missing:
+            user.set_unusable_password()
+        User.objects.bulk_create(missing, ignore_conflicts=True)
+        if missing:
+            created = User.objects.filter(username__in=[user.username for user in missing])
+            users.update((user.username, user) for user in created)
+        return users
+
+    def new_room_ids(self, count):
+        # Random room ids collide now and then at this scale, so draw until
+        # there are enough that are unique and unused.
+        room_ids = set()
+        while len(room_ids) < count:
+            candidates = {generate_room_id() for _ in range(count - len(room_ids))} - room_ids
+            taken = set(Game.objects.filter(room_id__in=candidates).values_list('room_id', flat=True))
+            room_ids |= candidates - taken
+        return list(room_ids)
+
+    def insert_rows(self, model, columns, rows):
+        # COPY on PostgreSQL, which is several times faster than multi-row
+        # INSERTs for the move and position tables; bulk_create elsewhere.
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                sql = f'COPY {model._meta.db_table} ({", ".join(columns)}) FROM STDIN'
+                with cursor.cursor.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+        else:
+            model.objects.bulk_create([model(**dict(zip(columns, row))) for row in rows], batch_size=5000)
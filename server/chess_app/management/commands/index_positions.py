@@ -0,0 +1,55 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from chess_app.models import Game, GamePosition
+from chess_app.positions import position_keys
+
+
+class Command(BaseCommand):
+    help = 'Fill the position search index for games saved before it existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Games read and indexed together.')
+        parser.add_argument('--rebuild', action='store_true', help='Reindex games that already have positions.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        indexed = positions = 0
+        last_pk = 0
+        started = time.perf_counter()
+        while True:
+            # keyset batches over the primary key, so each batch is one
+            # index range scan however far through the table it is
+            games = list(
+                Game.objects.filter(pk__gt=last_pk, moves__isnull=False)
+                .distinct()
+                .order_by('pk')
+                .prefetch_related('moves')[:batch_size]
+            )
+            if not games:
+                break
+            last_pk = games[-1].pk
+
+            game_ids = [game.pk for game in games]
+            with transaction.atomic():
+                if options['rebuild']:
+                    GamePosition.objects.filter(game_id__in=game_ids).delete()
+                    done = set()
+                else:
+                    done = set(
+                        GamePosition.objects.filter(game_id__in=game_ids).values_list('game_id', flat=True).distinct()
+                    )
+                rows = [
+                    GamePosition(game_id=game.pk, ply=ply, zobrist=zobrist)
+                    for game in games if game.pk not in done
+                    for ply, zobrist in enumerate(position_keys(move.uci for move in game.moves.all()), start=1)
+                ]
+                GamePosition.objects.bulk_create(rows, batch_size=5000)
+            indexed += len(games) - len(done)
+            positions += len(rows)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Indexed {positions} positions from {indexed} games in {elapsed:.1f}s')
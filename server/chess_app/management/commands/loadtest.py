@@ -0,0 +1,241 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from importlib import import_module
+import chess
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from chess_app import metrics
+from chess_app.models import Game, GamePosition
+from chess_app.routing import websocket_urlpatterns
+
+RECEIVE_TIMEOUT = 10
+
+
+class CommunicatorClient:
+    # Talks to the ASGI application in this process, so the run needs
+    # neither Daphne nor a network.
+
+    def __init__(self, application, room_id, user):
+        self.communicator = WebsocketCommunicator(application, f'/ws/match/{room_id}/')
+        self.communicator.scope['user'] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        return connected
+
+    async def send(self, data):
+        await self.communicator.send_json_to(data)
+
+    async def receive(self):
+        return await self.communicator.receive_json_from(timeout=RECEIVE_TIMEOUT)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    # Talks to a running server over real sockets, authenticated with a
+    # session created directly in the database the server uses.
+
+    def __init__(self, base_url, room_id, session_key):
+        self.url = f'{base_url.rstrip("/")}/ws/match/{room_id}/'
+        self.session_key = session_key
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+
+        self.socket = await websockets.connect(
+            self.url,
+            additional_headers={'Cookie': f'{settings.SESSION_COOKIE_NAME}={self.session_key}'},
+        )
+        return True
+
+    async def send(self, data):
+        await self.socket.send(json.dumps(data))
+
+    async def receive(self):
+        return json.loads(await asyncio.wait_for(self.socket.recv(), RECEIVE_TIMEOUT))
+
+    async def close(self):
+        await self.socket.close()
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[index] * 1000, 3)
+
+
+class Command(BaseCommand):
+    help = 'Play concurrent games against ChessConsumer and report throughput and latency as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=20, help='Games played concurrently.')
+        parser.add_argument('--plies', type=int, default=60, help='Maximum half-moves per game.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random legal games.')
+        parser.add_argument('--url', help='Base ws:// URL of a running server. Plays in-process when omitted.')
+        parser.add_argument('--label', default='', help='Free-form label copied into the report, e.g. a commit.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError('--url needs the websockets package: pip install websockets')
+
+        tag = uuid.uuid4().hex[:6]
+        players = []
+        for index in range(options['pairs']):
+            white = User.objects.create_user(username=f'lt-{tag}-{index}-w')
+            black = User.objects.create_user(username=f'lt-{tag}-{index}-b')
+            players.append((white, black))
+        games = Game.objects.bulk_create([
+            Game(
+                room_id=f'{tag[:3]}{index:05d}',
+                white_player=white,
+                black_player=black,
+                status='playing',
+                white_player_ready=True,
+                black_player_ready=True,
+            )
+            for index, (white, black) in enumerate(players)
+        ])
+
+        try:
+            if options['url']:
+                sessions = {user.pk: self.login(user) for pair in players for user in pair}
+                self.make_client = lambda room_id, user: SocketClient(options['url'], room_id, sessions[user.pk])
+            else:
+                application = URLRouter(websocket_urlpatterns)
+                self.make_client = lambda room_id, user: CommunicatorClient(application, room_id, user)
+
+            seats = [(game.room_id, white, black) for game, (white, black) in zip(games, players)]
+            queries_before = metrics.db_queries.values.get((), 0)
+            # Clients here move as fast as the server answers, far above the
+            # per-socket message limits, so those are off in this process.
+            with override_settings(SOCKET_MESSAGE_RATES=None):
+                report = async_to_sync(self.run)(seats, options['plies'], options['seed'])
+            queries = metrics.db_queries.values.get((), 0) - queries_before
+        finally:
+            GamePosition.objects.filter(game_id__in=[game.pk for game in games]).delete()
+            Game.objects.filter(pk__in=[game.pk for game in games]).delete()
+            User.objects.filter(username__startswith=f'lt-{tag}-').delete()
+
+        # Only queries made by this process are counted, so a remote server's
+        # queries are not visible here.
+        report['queries'] = None if options['url'] else queries
+        report['queries_per_move'] = (
+            round(queries / report['moves'], 3) if report['moves'] and not options['url'] else None
+        )
+        report.update({
+            'label': options['label'],
+            'mode': 'socket' if options['url'] else 'communicator',
+            'pairs': options['pairs'],
+            'plies': options['plies'],
+            'seed': options['seed'],
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'].rsplit('.', 1)[-1],
+        })
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def login(self, user):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    async def run(self, seats, plies, seed):
+        latencies = []
+        errors = []
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(self.play(room_id, white, black, plies, random.Random(seed + index), latencies)
+              for index, (room_id, white, black) in enumerate(seats)),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - started
+
+        moves = 0
+        for result in results:
+            if isinstance(result, BaseException):
+                errors.append(repr(result))
+            else:
+                moves += result
+
+        return {
+            'moves': moves,
+            'duration_s': round(elapsed, 3),
+            'moves_per_sec': round(moves / elapsed, 1) if elapsed else None,
+            'latency_ms': {
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'max': percentile(latencies, 1.0),
+            },
+            'errors': errors,
+        }
+
+    async def play(self, room_id, white_user, black_user, plies, rng, latencies):
+        white = self.make_client(room_id, white_user)
+        black = self.make_client(room_id, black_user)
+        for client in (white, black):
+            if not await client.connect():
+                raise CommandError('Connection was rejected')
+
+        sockets = {chess.WHITE: white, chess.BLACK: black}
+        board = chess.Board()
+        played = 0
+        try:
+            while played < plies and not board.is_game_over():
+                move = rng.choice(list(board.legal_moves))
+                board.push(move)
+                played += 1
+
+                uci = move.uci()
+                message = {'type': 'move', 'from': uci[:2], 'to': uci[2:4]}
+                if move.promotion:
+                    message['promotion'] = uci[4]
+
+                mover, opponent = sockets[not board.turn], sockets[board.turn]
+                sent_at = time.perf_counter()
+                await mover.send(message)
+                event = await self.wait_for_ply(opponent, played)
+                latencies.append(time.perf_counter() - sent_at)
+                await self.wait_for_ply(mover, played)
+                # the server also ends games on repetition and the fifty-move
+                # rule, which board.is_game_over() does not check by default
+                if event['status'] == 'finished':
+                    break
+        finally:
+            await white.close()
+            await black.close()
+        return played
+
+    async def wait_for_ply(self, client, ply):
+        while True:
+            event = await client.receive()
+            if event.get('type') == 'error':
+                raise CommandError(event.get('message'))
+            if event.get('type') == 'move_made' and event['ply'] == ply:
+                return event
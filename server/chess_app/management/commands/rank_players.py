@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from chess_app.ratings import rank_players
+
+
+class Command(BaseCommand):
+    help = 'Store every player\'s leaderboard position, for rank lookups. Run it periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows read and written together.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        started = time.perf_counter()
+        updated = rank_players(options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Updated {updated} ranks in {elapsed:.1f}s')
@@ -0,0 +1,115 @@
+import time
+from datetime import timedelta
+import chess
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from chess_app.models import ArchivedGame, Game
+from chess_app.ratings import record_result
+
+
+class Command(BaseCommand):
+    help = 'End games nobody is playing any more and archive old finished games.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--waiting-hours', type=float, default=24,
+                            help='Abort games still waiting for an opponent after this long.')
+        parser.add_argument('--playing-hours', type=float, default=24,
+                            help='End games with no move saved for this long.')
+        parser.add_argument('--archive-days', type=float, default=30,
+                            help='Archive games finished longer ago than this.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Games handled per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be done.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        now = timezone.now()
+        started = time.perf_counter()
+
+        aborted = self.end_stale('waiting', now - timedelta(hours=options['waiting_hours']))
+        abandoned = self.end_stale('playing', now - timedelta(hours=options['playing_hours']))
+        archived = self.archive(now - timedelta(days=options['archive_days']))
+
+        elapsed = time.perf_counter() - started
+        prefix = 'Would have' if self.dry_run else 'Done:'
+        self.stdout.write(
+            f'{prefix} aborted {aborted} waiting games, ended {abandoned} abandoned games '
+            f'and archived {archived} finished games in {elapsed:.1f}s'
+        )
+
+    def end_stale(self, status, cutoff):
+        # Served by the partial index on unfinished games. Each game is
+        # ended with a version check, so a room that saves a move meanwhile
+        # keeps its game going and this run skips it.
+        stale = Game.objects.filter(status=status, updated_at__lt=cutoff)
+        if self.dry_run:
+            return stale.count()
+
+        ended = 0
+        last_pk = 0
+        while True:
+            games = list(stale.filter(pk__gt=last_pk).order_by('pk')[:self.batch_size])
+            if not games:
+                return ended
+            last_pk = games[-1].pk
+            for game in games:
+                if game.compare_and_update(status='finished', **self.outcome(game)):
+                    ended += 1
+                    record_result(game.pk)
+
+    def outcome(self, game):
+        # A game nobody joined, or that never got past the first move, is
+        # aborted. Otherwise the side that stopped moving loses.
+        if game.status == 'waiting' or game.moves.count() < 2:
+            return {'result': '', 'termination': 'aborted'}
+        loser = chess.Board(game.fen_position).turn
+        return {'result': '0-1' if loser == chess.WHITE else '1-0', 'termination': 'abandoned'}
+
+    def archive(self, cutoff):
+        # Games are rated before they are archived. record_result only
+        # reads Game rows, so an unrated archived game would wait for the
+        # next recompute_ratings.
+        finished = Game.objects.filter(status='finished', updated_at__lt=cutoff)
+        if self.dry_run:
+            return finished.count()
+
+        archived = 0
+        while True:
+            with transaction.atomic():
+                # Locked rows are being written by a live room right now,
+                # so they are left for the next run.
+                games = list(
+                    finished.select_for_update(skip_locked=True, of=('self',))
+                    .order_by('pk')
+                    .prefetch_related('moves')[:self.batch_size]
+                )
+                if not games:
+                    return archived
+
+                for game in games:
+                    if not game.rating_applied:
+                        record_result(game.pk)
+                ArchivedGame.objects.bulk_create([
+                    ArchivedGame(
+                        original_id=game.pk,
+                        room_id=game.room_id,
+                        white_player_id=game.white_player_id,
+                        black_player_id=game.black_player_id,
+                        fen_position=game.fen_position,
+                        time_control_base=game.time_control_base,
+                        time_control_increment=game.time_control_increment,
+                        result=game.result,
+                        termination=game.termination,
+                        moves=' '.join(move.uci for move in game.moves.all()),
+                        created_at=game.created_at,
+                        finished_at=game.updated_at,
+                    )
+                    for game in games
+                ], ignore_conflicts=True)
+                # Moves go with the game. Positions stay, keyed by what is
+                # now original_id, so position search still finds it.
+                Game.objects.filter(pk__in=[game.pk for game in games]).delete()
+                archived += len(games)
@@ -0,0 +1,79 @@
+import heapq
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from chess_app.models import ArchivedGame, Game, Rating
+from chess_app.ratings import LEADERBOARD_CACHE_KEY, SCORES, elo, rank_players, record_result
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every rating from scratch by replaying finished games in order.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows read and written together.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        started = time.perf_counter()
+        # Games that finish while this runs are rated on their own, after.
+        cutoff = timezone.now()
+
+        bot_id = User.objects.filter(username=settings.BOT_USERNAME).values_list('pk', flat=True).first()
+        rated = {'result__in': list(SCORES), 'white_player__isnull': False, 'black_player__isnull': False}
+        games = (
+            Game.objects
+            .filter(status='finished', updated_at__lt=cutoff, **rated)
+            .exclude(white_player_id=bot_id)
+            .exclude(black_player_id=bot_id)
+            .order_by('updated_at', 'pk')
+            .values_list('updated_at', 'white_player_id', 'black_player_id', 'result')
+        )
+        archived = (
+            ArchivedGame.objects
+            .filter(**rated)
+            .exclude(white_player_id=bot_id)
+            .exclude(black_player_id=bot_id)
+            .order_by('finished_at', 'pk')
+            .values_list('finished_at', 'white_player_id', 'black_player_id', 'result')
+        )
+
+        # Only two numbers per player are held in memory; games are streamed
+        # from both tables in the order they finished.
+        ratings = {}
+        counted = 0
+        history = heapq.merge(
+            archived.iterator(chunk_size=batch_size),
+            games.iterator(chunk_size=batch_size),
+            key=lambda row: row[0],
+        )
+        for _, white_id, black_id, result in history:
+            white = ratings.get(white_id, (settings.DEFAULT_RATING, 0))
+            black = ratings.get(black_id, (settings.DEFAULT_RATING, 0))
+            new_white, new_black = elo(white[0], black[0], white[1], black[1], result)
+            ratings[white_id] = (new_white, white[1] + 1)
+            ratings[black_id] = (new_black, black[1] + 1)
+            counted += 1
+
+        with transaction.atomic():
+            Rating.objects.all().delete()
+            Rating.objects.bulk_create(
+                [Rating(user_id=user_id, rating=rating, games=played) for user_id, (rating, played) in ratings.items()],
+                batch_size=batch_size,
+            )
+            Game.objects.filter(status='finished', updated_at__lt=cutoff).update(rating_applied=True)
+            # Any rating they already got was in the rows just replaced.
+            late = list(Game.objects.filter(status='finished', updated_at__gte=cutoff).values_list('pk', flat=True))
+            Game.objects.filter(pk__in=late).update(rating_applied=False)
+        for game_id in late:
+            record_result(game_id)
+        cache.delete(LEADERBOARD_CACHE_KEY)
+        rank_players(batch_size)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Rated {len(ratings)} players from {counted} games in {elapsed:.1f}s')
@@ -0,0 +1,190 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import random
+import time
+from django.conf import settings
+from channels.layers import get_channel_layer
+from . import metrics
+from .models import Game
+
+logger = logging.getLogger(__name__)
+
+
+class Seeker:
+    __slots__ = ('user', 'rating', 'channel_name', 'joined_at', 'key')
+
+    def __init__(self, user, rating, channel_name, joined_at, seq):
+        self.user = user
+        self.rating = rating
+        self.channel_name = channel_name
+        self.joined_at = joined_at
+        self.key = (rating, seq)
+
+    def window(self, now):
+        # Rating difference this player accepts, widening while they wait.
+        waited = now - self.joined_at
+        return min(
+            settings.MATCHMAKING_WINDOW + settings.MATCHMAKING_WINDOW_GROWTH * waited,
+            settings.MATCHMAKING_MAX_WINDOW,
+        )
+
+
+def acceptable(a, b, now):
+    if a.user.pk == b.user.pk:
+        return False
+    return abs(a.rating - b.rating) <= max(a.window(now), b.window(now))
+
+
+class MatchQueue:
+    # Players waiting for one time control, sorted by rating. An arrival is
+    # compared with its nearest neighbours only, found by bisection.
+
+    def __init__(self):
+        self.keys = []
+        self.seekers = []
+
+    def __len__(self):
+        return len(self.seekers)
+
+    def add(self, seeker, now):
+        index = bisect.bisect_left(self.keys, seeker.key)
+        neighbours = [i for i in (index - 1, index) if 0 <= i < len(self.seekers)]
+        neighbours = [i for i in neighbours if acceptable(seeker, self.seekers[i], now)]
+        if neighbours:
+            best = min(neighbours, key=lambda i: abs(self.seekers[i].rating - seeker.rating))
+            return self._pop(best)
+
+        self.insert(seeker)
+        return None
+
+    def insert(self, seeker):
+        index = bisect.bisect_left(self.keys, seeker.key)
+        self.keys.insert(index, seeker.key)
+        self.seekers.insert(index, seeker)
+
+    def remove(self, seeker):
+        index = bisect.bisect_left(self.keys, seeker.key)
+        if index < len(self.keys) and self.keys[index] == seeker.key:
+            self._pop(index)
+
+    def _pop(self, index):
+        del self.keys[index]
+        return self.seekers.pop(index)
+
+    def sweep(self, now):
+        # Windows widen with time, so pairs that were too far apart on
+        # arrival are matched later. Only neighbours in rating order need
+        # to be compared.
+        pairs = []
+        index = 0
+        while index < len(self.seekers) - 1:
+            first, second = self.seekers[index], self.seekers[index + 1]
+            if acceptable(first, second, now):
+                self._pop(index + 1)
+                self._pop(index)
+                pairs.append((first, second))
+            else:
+                index += 1
+        return pairs
+
+
+class Matchmaker:
+    def __init__(self):
+        self.queues = {}
+        self.seeking = {}
+        self._seq = itertools.count()
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self.seeking)
+
+    async def join(self, user, rating, channel_name, time_control):
+        self.leave(user)
+        seeker = Seeker(user, rating, channel_name, time.monotonic(), next(self._seq))
+        queue = self.queues.setdefault(time_control, MatchQueue())
+        opponent = queue.add(seeker, seeker.joined_at)
+        if opponent is None:
+            self.seeking[user.pk] = (time_control, seeker)
+            self._start_sweeper()
+        else:
+            del self.seeking[opponent.user.pk]
+            await self._start_or_requeue(opponent, seeker, time_control)
+        metrics.matchmaking_seekers.set(value=len(self.seeking))
+
+    def leave(self, user):
+        entry = self.seeking.pop(user.pk, None)
+        if entry is not None:
+            time_control, seeker = entry
+            self.queues[time_control].remove(seeker)
+            metrics.matchmaking_seekers.set(value=len(self.seeking))
+
+    def _start_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.ensure_future(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while self.seeking:
+            await asyncio.sleep(settings.MATCHMAKING_SWEEP_INTERVAL)
+            await self.sweep(time.monotonic())
+
+    async def sweep(self, now):
+        for time_control, queue in list(self.queues.items()):
+            for first, second in queue.sweep(now):
+                # Starting earlier games awaits, so either player may have
+                # left or queued again since the sweep.
+                claimed = [seeker for seeker in (first, second) if self._claim(seeker)]
+                if len(claimed) == 2:
+                    await self._start_or_requeue(first, second, time_control)
+                else:
+                    for seeker in claimed:
+                        self._requeue(seeker, time_control)
+        metrics.matchmaking_seekers.set(value=len(self.seeking))
+
+    def _claim(self, seeker):
+        entry = self.seeking.get(seeker.user.pk)
+        if entry is None or entry[1] is not seeker:
+            return False
+        del self.seeking[seeker.user.pk]
+        return True
+
+    def _requeue(self, seeker, time_control):
+        # Back in line under its original join time; the next sweep pairs it.
+        self.seeking[seeker.user.pk] = (time_control, seeker)
+        self.queues.setdefault(time_control, MatchQueue()).insert(seeker)
+
+    async def _start_or_requeue(self, first, second, time_control):
+        try:
+            await self.start_game(first, second, time_control)
+        except Exception:
+            logger.exception('Could not start a matched game')
+            for seeker in (first, second):
+                if seeker.user.pk not in self.seeking:
+                    self._requeue(seeker, time_control)
+            self._start_sweeper()
+
+    async def start_game(self, first, second, time_control):
+        white, black = random.sample([first, second], 2)
+        base, increment = time_control
+        game = await Game.objects.acreate(
+            white_player=white.user,
+            black_player=black.user,
+            status='playing',
+            white_player_ready=True,
+            black_player_ready=True,
+            time_control_base=base,
+            time_control_increment=increment,
+        )
+
+        channel_layer = get_channel_layer()
+        for seeker, color in ((white, 'white'), (black, 'black')):
+            await channel_layer.send(seeker.channel_name, {
+                'type': 'match.found',
+                'room_id': game.room_id,
+                'color': color,
+                'opponent': (black if seeker is white else white).user.username,
+            })
+
+
+matchmaker = Matchmaker()
@@ -0,0 +1,177 @@
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db.backends.signals import connection_created
+
+# Process-wide metrics rendered in the Prometheus text format by the
+# /metrics view. Recording is a few dict lookups and a bisect, so it is
+# cheap enough to leave on around every consumer message.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in sorted(self.values.items()):
+            yield f'{self.name}{_format_labels(self.labels, label_values)} {value}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value):
+        self.values[label_values] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            # one slot per bucket plus +Inf, then the running sum
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {series[-1]}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_seconds = registry.register(Histogram(
+    'kg_handler_duration_seconds', 'Time spent handling one WebSocket message.', ('handler',)))
+handler_queries = registry.register(Histogram(
+    'kg_handler_db_queries', 'Database queries run while handling one WebSocket message.',
+    ('handler',), QUERY_BUCKETS))
+handler_db_seconds = registry.register(Histogram(
+    'kg_handler_db_seconds', 'Database time spent while handling one WebSocket message.', ('handler',)))
+db_queries = registry.register(Counter(
+    'kg_db_queries_total', 'Database queries run by this process.'))
+db_seconds = registry.register(Counter(
+    'kg_db_query_seconds_total', 'Time spent in database queries by this process.'))
+group_send_seconds = registry.register(Histogram(
+    'kg_group_send_duration_seconds', 'Time spent in channel layer group_send.'))
+connections = registry.register(Gauge(
+    'kg_active_connections', 'Open WebSocket connections.', ('consumer',)))
+games = registry.register(Gauge(
+    'kg_games', 'Unfinished games stored in the database, by status.', ('status',)))
+live_rooms = registry.register(Gauge(
+    'kg_live_rooms', 'Games whose state is held in memory by this process.'))
+matchmaking_seekers = registry.register(Gauge(
+    'kg_matchmaking_seekers', 'Players waiting in the matchmaking queue.'))
+bot_searches = registry.register(Gauge(
+    'kg_bot_searches', 'Bot move searches running or waiting for a worker.'))
+dropped_messages = registry.register(Counter(
+    'kg_dropped_messages_total', 'WebSocket messages dropped by the per-socket rate limit.',
+    ('message_type',)))
+resumes = registry.register(Counter(
+    'kg_resumes_total', 'Game sockets brought up to date, by replayed events or a full snapshot.',
+    ('outcome',)))
+position_cache = registry.register(Gauge(
+    'kg_position_cache', 'Position cache size, lookups and hit rate.', ('stat',)))
+
+_message_stats = ContextVar('kg_message_stats', default=None)
+
+
+def record_query(seconds):
+    db_queries.inc()
+    db_seconds.inc(amount=seconds)
+    stats = _message_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += seconds
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_query(time.perf_counter() - started)
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install_query_timer)
+
+
+@contextmanager
+def track_handler(name):
+    stats = [0, 0.0]
+    token = _message_stats.set(stats)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        handler_seconds.observe(time.perf_counter() - started, name)
+        handler_queries.observe(stats[0], name)
+        handler_db_seconds.observe(stats[1], name)
+        _message_stats.reset(token)
+
+
+async def group_send(channel_layer, group, message):
+    started = time.perf_counter()
+    try:
+        await channel_layer.group_send(group, message)
+    finally:
+        group_send_seconds.observe(time.perf_counter() - started)
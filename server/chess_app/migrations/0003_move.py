@@ -0,0 +1,59 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_moves_to_table(apps, schema_editor):
+    Game = apps.get_model('chess_app', 'Game')
+    Move = apps.get_model('chess_app', 'Move')
+    for game in Game.objects.exclude(moves=[]).only('id', 'moves', 'updated_at').iterator(chunk_size=500):
+        Move.objects.bulk_create(
+            [Move(game_id=game.id, ply=ply, uci=uci, played_at=game.updated_at)
+             for ply, uci in enumerate(game.moves, start=1)],
+            batch_size=1000,
+        )
+
+
+def copy_moves_to_json(apps, schema_editor):
+    Game = apps.get_model('chess_app', 'Game')
+    Move = apps.get_model('chess_app', 'Move')
+    for game in Game.objects.filter(move_rows__isnull=False).distinct().iterator(chunk_size=500):
+        game.moves = list(Move.objects.filter(game_id=game.id).order_by('ply').values_list('uci', flat=True))
+        game.save(update_fields=['moves'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0002_game_black_player_ready_game_white_player_ready'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Move',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply', models.PositiveIntegerField()),
+                ('uci', models.CharField(max_length=5)),
+                ('played_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='move_rows', to='chess_app.game')),
+            ],
+            options={
+                'ordering': ['ply'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='move',
+            constraint=models.UniqueConstraint(fields=('game', 'ply'), name='unique_move_per_ply'),
+        ),
+        migrations.RunPython(copy_moves_to_table, copy_moves_to_json),
+        migrations.RemoveField(
+            model_name='game',
+            name='moves',
+        ),
+        migrations.AlterField(
+            model_name='move',
+            name='game',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='moves', to='chess_app.game'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0004_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='time_control_base',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='time_control_increment',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='result',
+            field=models.CharField(blank=True, choices=[('1-0', 'White wins'), ('0-1', 'Black wins'), ('1/2-1/2', 'Draw')], default='', max_length=7),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='termination',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0005_game_clock_and_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='position_counts',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0006_game_position_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['white_player', '-created_at', '-id'], name='game_white_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['black_player', '-created_at', '-id'], name='game_black_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('status__in', ['waiting', 'playing'])), fields=['status', 'updated_at'], name='game_active_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0007_game_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GamePosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply', models.PositiveIntegerField()),
+                ('zobrist', models.BigIntegerField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='chess_app.game')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['zobrist', 'game', 'ply'], name='gameposition_zobrist_idx')],
+                'constraints': [models.UniqueConstraint(fields=('game', 'ply'), name='unique_position_per_ply')],
+            },
+        ),
+    ]
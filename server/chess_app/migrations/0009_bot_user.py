@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import migrations
+
+
+# The computer opponent plays as this account. Creating it here keeps the
+# name from being registered by a person first.
+def create_bot_user(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    User.objects.get_or_create(username=settings.BOT_USERNAME, defaults={'password': make_password(None)})
+
+
+def delete_bot_user(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    User.objects.filter(username=settings.BOT_USERNAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0008_gameposition'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_bot_user, delete_bot_user),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0010_ratings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedGame',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('room_id', models.CharField(max_length=8)),
+                ('fen_position', models.CharField(max_length=100)),
+                ('time_control_base', models.PositiveIntegerField(blank=True, null=True)),
+                ('time_control_increment', models.PositiveIntegerField(default=0)),
+                ('result', models.CharField(blank=True, choices=[('1-0', 'White wins'), ('0-1', 'Black wins'), ('1/2-1/2', 'Draw')], default='', max_length=7)),
+                ('termination', models.CharField(blank=True, default='', max_length=32)),
+                ('moves', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('black_player', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_games_as_black', to=settings.AUTH_USER_MODEL)),
+                ('white_player', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_games_as_white', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['white_player', 'created_at'], name='archived_white_idx'), models.Index(fields=['black_player', 'created_at'], name='archived_black_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0011_archivedgame'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedgame',
+            name='archived_white_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='archivedgame',
+            name='archived_black_idx',
+        ),
+        migrations.AddIndex(
+            model_name='archivedgame',
+            index=models.Index(fields=['white_player', '-created_at', '-original_id'], name='archived_white_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedgame',
+            index=models.Index(fields=['black_player', '-created_at', '-original_id'], name='archived_black_idx'),
+        ),
+    ]
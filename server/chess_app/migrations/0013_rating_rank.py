@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0012_archived_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rating',
+            name='rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
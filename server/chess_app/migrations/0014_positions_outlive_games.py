@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0013_rating_rank'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gameposition',
+            name='game',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='positions', to='chess_app.game'),
+        ),
+    ]
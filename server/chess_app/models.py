@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 def generate_room_id():
@@ -22,12 +23,184 @@ class Game(models.Model):
     white_player_ready = models.BooleanField(default=False)
     black_player_ready = models.BooleanField(default=False)
 
-    moves = models.JSONField(default=list)
-
     fen_position = models.CharField(max_length=100, default='rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
 
+    # Seconds on each clock at the start and added after every move. Games
+    # without a base time are untimed.
+    time_control_base = models.PositiveIntegerField(null=True, blank=True)
+    time_control_increment = models.PositiveIntegerField(default=0)
+
+    RESULT_CHOICES = [
+        ('1-0', 'White wins'),
+        ('0-1', 'Black wins'),
+        ('1/2-1/2', 'Draw'),
+    ]
+
+    result = models.CharField(max_length=7, choices=RESULT_CHOICES, blank=True, default='')
+    termination = models.CharField(max_length=32, blank=True, default='')
+
+    # Occurrences of each position (by hex Zobrist hash) since the last
+    # capture, pawn move or loss of castling rights, for repetition draws.
+    position_counts = models.JSONField(default=dict, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Bumped by every conditional write, see compare_and_update.
+    version = models.PositiveIntegerField(default=0)
+
+    # Set once the result has been counted in both players' ratings.
+    rating_applied = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # a player's games newest first, for keyset pagination
+            models.Index(fields=['white_player', '-created_at', '-id'], name='game_white_history_idx'),
+            models.Index(fields=['black_player', '-created_at', '-id'], name='game_black_history_idx'),
+            # games that are not finished yet are few, so index only those
+            models.Index(
+                fields=['status', 'updated_at'],
+                name='game_active_idx',
+                condition=models.Q(status__in=['waiting', 'playing']),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Game {self.room_id} - {self.status}"
+
+    def _versioned_update(self, fields):
+        fields['updated_at'] = timezone.now()
+        query = Game.objects.filter(pk=self.pk, version=self.version)
+        return query, dict(fields, version=models.F('version') + 1)
+
+    def _apply_update(self, fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.version += 1
+
+    def compare_and_update(self, **fields):
+        # Writes only the given columns, and only if nobody else has written
+        # the row since this instance was loaded. Returns False on conflict.
+        query, values = self._versioned_update(fields)
+        if not query.update(**values):
+            return False
+        self._apply_update(fields)
+        return True
+
+    async def acompare_and_update(self, **fields):
+        query, values = self._versioned_update(fields)
+        if not await query.aupdate(**values):
+            return False
+        self._apply_update(fields)
+        return True
+
+    def move_list(self):
+        return list(self.moves.values_list('uci', flat=True))
+
+    async def amove_list(self):
+        return [uci async for uci in self.moves.values_list('uci', flat=True)]
+
+
+class Move(models.Model):
+    game = models.ForeignKey(Game, related_name='moves', on_delete=models.CASCADE)
+    ply = models.PositiveIntegerField()
+    uci = models.CharField(max_length=5)
+    played_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['ply']
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'ply'], name='unique_move_per_ply'),
+        ]
+
     def __str__(self):
-        return f"Game {self.room_id} - {self.status}"
\ No newline at end of file
+        return f"{self.game.room_id} #{self.ply} {self.uci}"
+
+
+class ArchivedGame(models.Model):
+    # Finished games moved out of Game by the reap_games command, with the
+    # moves folded into one space-separated UCI string. Their Move rows are
+    # dropped, which keeps the live tables small; their GamePosition rows
+    # stay, under original_id.
+    original_id = models.BigIntegerField(unique=True)
+    room_id = models.CharField(max_length=8)
+    white_player = models.ForeignKey(User, related_name='archived_games_as_white', on_delete=models.SET_NULL, null=True)
+    black_player = models.ForeignKey(User, related_name='archived_games_as_black', on_delete=models.SET_NULL, null=True)
+    fen_position = models.CharField(max_length=100)
+    time_control_base = models.PositiveIntegerField(null=True, blank=True)
+    time_control_increment = models.PositiveIntegerField(default=0)
+    result = models.CharField(max_length=7, choices=Game.RESULT_CHOICES, blank=True, default='')
+    termination = models.CharField(max_length=32, blank=True, default='')
+    moves = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    status = 'finished'
+
+    class Meta:
+        indexes = [
+            # same order as the Game history indexes, keyed by the old id
+            models.Index(fields=['white_player', '-created_at', '-original_id'], name='archived_white_idx'),
+            models.Index(fields=['black_player', '-created_at', '-original_id'], name='archived_black_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived game {self.room_id}"
+
+    def move_list(self):
+        return self.moves.split()
+
+
+class GamePosition(models.Model):
+    # Every position a game passed through, by signed 64-bit Zobrist hash,
+    # for finding the games that reached a given position. The rows outlive
+    # the Game row when it is archived, so there is no database constraint.
+    game = models.ForeignKey(Game, related_name='positions', on_delete=models.DO_NOTHING, db_constraint=False)
+    ply = models.PositiveIntegerField()
+    zobrist = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['zobrist', 'game', 'ply'], name='gameposition_zobrist_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'ply'], name='unique_position_per_ply'),
+        ]
+
+    def __str__(self):
+        return f"{self.game.room_id} #{self.ply} {self.zobrist}"
+
+
+class Rating(models.Model):
+    user = models.OneToOneField(User, related_name='rating', on_delete=models.CASCADE)
+    rating = models.FloatField()
+    games = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=0)
+    # Position on the leaderboard as of the last rank_players run, so a
+    # player's rank is read rather than counted. None until first ranked.
+    rank = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the leaderboard, best first
+            models.Index(fields=['-rating', 'user'], name='rating_leaderboard_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.rating:.0f}"
+
+    def compare_and_update(self, **fields):
+        # Same contract as Game.compare_and_update.
+        updated = Rating.objects.filter(pk=self.pk, version=self.version).update(
+            **fields,
+            updated_at=timezone.now(),
+            version=models.F('version') + 1,
+        )
+        if not updated:
+            return False
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.version += 1
+        return True
@@ -0,0 +1,49 @@
+import chess
+
+LINE_LENGTH = 80
+
+
+def pgn_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def game_pgn(game, moves):
+    # PGN for one game. SAN is worked out move by move on a single board, so
+    # the cost is linear in the length of the game.
+    result = game.result or '*'
+    headers = [
+        ('Event', 'KingsGambit game'),
+        ('Site', game.room_id),
+        ('Date', game.created_at.strftime('%Y.%m.%d')),
+        ('Round', '-'),
+        ('White', game.white_player.username if game.white_player else '?'),
+        ('Black', game.black_player.username if game.black_player else '?'),
+        ('Result', result),
+    ]
+    if game.time_control_base:
+        headers.append(('TimeControl', f'{game.time_control_base}+{game.time_control_increment}'))
+    if game.termination:
+        headers.append(('Termination', game.termination.replace('_', ' ')))
+
+    lines = [f'[{name} "{pgn_value(value)}"]' for name, value in headers]
+    lines.append('')
+
+    board = chess.Board()
+    tokens = []
+    for uci in moves:
+        move = chess.Move.from_uci(uci)
+        if board.turn == chess.WHITE:
+            tokens.append(f'{board.fullmove_number}.')
+        tokens.append(board.san(move))
+        board.push(move)
+    tokens.append(result)
+
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
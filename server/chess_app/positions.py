@@ -0,0 +1,94 @@
+from collections import OrderedDict
+import chess
+import chess.polyglot
+from django.conf import settings
+
+
+class Position:
+    __slots__ = ('legal_moves', 'termination')
+
+    def __init__(self, board):
+        self.legal_moves = frozenset(move.uci() for move in board.legal_moves)
+        if not self.legal_moves:
+            self.termination = 'checkmate' if board.is_check() else 'stalemate'
+        elif board.is_insufficient_material():
+            self.termination = 'insufficient_material'
+        else:
+            self.termination = ''
+
+
+class PositionCache:
+    # Legal moves and game-over status by Zobrist hash, shared by every room
+    # in the process. Openings and common endings repeat across games, so
+    # most moves are validated with a lookup instead of move generation.
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, board, key=None):
+        if key is None:
+            key = chess.polyglot.zobrist_hash(board)
+        position = self._entries.get(key)
+        if position is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return position
+
+        self.misses += 1
+        position = Position(board)
+        if self.max_size > 0:
+            self._entries[key] = position
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return position
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+def position_key(key):
+    return format(key, '016x')
+
+
+def signed_key(key):
+    # Zobrist hashes are unsigned; the database column is a signed bigint.
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def position_keys(moves):
+    # The signed Zobrist hash after each move, from the starting position.
+    board = chess.Board()
+    for uci in moves:
+        board.push(chess.Move.from_uci(uci))
+        yield signed_key(chess.polyglot.zobrist_hash(board))
+
+
+def count_positions(moves):
+    # Rebuilds Game.position_counts by replaying a game from the start, for
+    # rows saved before the counts were kept.
+    board = chess.Board()
+    counts = {position_key(chess.polyglot.zobrist_hash(board)): 1}
+    for uci in moves:
+        move = chess.Move.from_uci(uci)
+        if board.is_irreversible(move):
+            counts.clear()
+        board.push(move)
+        key = position_key(chess.polyglot.zobrist_hash(board))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+positions = PositionCache(settings.POSITION_CACHE_SIZE)
@@ -0,0 +1,153 @@
+import json
+import chess
+import msgpack
+
+# Wire formats for the WebSocket consumers. JSON text is the default; a
+# client that offers the msgpack subprotocol gets binary frames instead.
+# A msgpack frame is an array of the message type code followed by the
+# fields listed for that type, in order, with moves sent as
+# [from_square, to_square, promotion_piece] and clocks as
+# [white, black, running].
+
+SUBPROTOCOL = 'kingsgambit.msgpack'
+FORMATS = ('json', 'msgpack')
+
+MESSAGE_CODES = {
+    'game_state_update': 1,
+    'move_made': 2,
+    'game_over': 3,
+    'chat_message': 4,
+    'video_signal': 5,
+    'error': 6,
+    'lobby_state_update': 7,
+    'move': 8,
+    'resync': 9,
+    'player_ready': 10,
+    'join_queue': 11,
+    'leave_queue': 12,
+    'queue_joined': 13,
+    'match_found': 14,
+    'resume': 15,
+}
+MESSAGE_TYPES = {code: name for name, code in MESSAGE_CODES.items()}
+
+SERVER_FIELDS = {
+    'game_state_update': (
+        'white_player', 'black_player', 'fen', 'status', 'moves', 'ply',
+        'result', 'termination', 'clock', 'player_color',
+    ),
+    'move_made': ('ply', 'move', 'fen', 'status', 'result', 'termination', 'clock'),
+    'game_over': ('status', 'result', 'termination', 'clock'),
+    'chat_message': ('message', 'sender'),
+    'video_signal': ('peerId', 'sender'),
+    'error': ('message',),
+    'lobby_state_update': ('whitePlayer', 'blackPlayer', 'whitePlayerReady', 'blackPlayerReady'),
+    'queue_joined': ('rating',),
+    'match_found': ('room_id', 'color', 'opponent'),
+}
+
+CLIENT_FIELDS = {
+    'move': ('move',),
+    'resync': (),
+    'resume': ('ply',),
+    'player_ready': (),
+    'chat_message': ('message',),
+    'video_signal': ('peerId',),
+    'join_queue': ('time_control',),
+    'leave_queue': (),
+}
+
+
+def pack_move(uci):
+    move = chess.Move.from_uci(uci)
+    return [move.from_square, move.to_square, move.promotion or 0]
+
+
+def pack_clock(clock):
+    if clock is None:
+        return None
+    return [clock['white'], clock['black'], clock['running']]
+
+
+PACKERS = {
+    'move': pack_move,
+    'moves': lambda moves: [pack_move(uci) for uci in moves],
+    'clock': pack_clock,
+}
+
+
+def encode(event, wire_format):
+    if wire_format == 'json':
+        return json.dumps(event)
+
+    message_type = event['type']
+    frame = [MESSAGE_CODES[message_type]]
+    for field in SERVER_FIELDS[message_type]:
+        value = event.get(field)
+        if field in PACKERS:
+            value = PACKERS[field](value)
+        frame.append(value)
+    return msgpack.packb(frame)
+
+
+def valid_move(move):
+    if not isinstance(move, list) or len(move) != 3 or not all(type(value) is int for value in move):
+        return False
+    from_square, to_square, promotion = move
+    return (
+        0 <= from_square < 64 and 0 <= to_square < 64
+        and (promotion == 0 or chess.KNIGHT <= promotion <= chess.QUEEN)
+    )
+
+
+def decode(data, wire_format):
+    # Frames come straight from clients, so anything malformed decodes to
+    # an empty message rather than raising in the consumer.
+    if wire_format == 'json':
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return {}
+        if not isinstance(message, dict):
+            return {}
+        if message.get('type') == 'move' and not all(
+            isinstance(message.get(field, ''), str) for field in ('from', 'to', 'promotion')
+        ):
+            return {}
+        return message
+
+    try:
+        frame = msgpack.unpackb(data)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        return {}
+    if not isinstance(frame, list) or not frame or frame[0] not in MESSAGE_TYPES:
+        return {}
+
+    message_type = MESSAGE_TYPES[frame[0]]
+    message = dict(zip(CLIENT_FIELDS.get(message_type, ()), frame[1:]))
+    message['type'] = message_type
+    if message_type == 'move':
+        if not valid_move(message.get('move')):
+            return {}
+        from_square, to_square, promotion = message.pop('move')
+        message['from'] = chess.square_name(from_square)
+        message['to'] = chess.square_name(to_square)
+        message['promotion'] = chess.piece_symbol(promotion) if promotion else ''
+    return message
+
+
+def frame(event, formats=FORMATS):
+    # A channel layer message carrying the event already encoded in each
+    # format, for consumers to forward without encoding it again. JSON is
+    # always there, for a socket whose format the sender did not count.
+    message = {'type': 'send.frame', 'json': encode(event, 'json')}
+    for wire_format in formats:
+        if wire_format not in message:
+            message[wire_format] = encode(event, wire_format)
+    return message
+
+
+def frame_payload(message, wire_format):
+    if wire_format in message:
+        return message[wire_format]
+    return encode(json.loads(message['json']), wire_format)
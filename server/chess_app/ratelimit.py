@@ -0,0 +1,131 @@
+import time
+from functools import wraps
+from inspect import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django_ratelimit.exceptions import Ratelimited
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+# HTTP limits are sliding windows kept in the shared cache, so every
+# worker counts against the same totals. Each window is approximated from
+# two fixed-window counters: the previous one is weighted by how much of
+# it still overlaps the last `window` seconds. That is two atomic cache
+# operations and a read per request, without the double burst a plain
+# fixed window lets through at its edges.
+
+def _window_keys(name, window, now):
+    current = int(now // window)
+    overlap = 1 - (now % window) / window
+    return f'rl:{name}:{current}', f'rl:{name}:{current - 1}', overlap
+
+
+def is_limited(name, limit, window, now=None):
+    now = time.time() if now is None else now
+    current_key, previous_key, overlap = _window_keys(name, window, now)
+    cache.add(current_key, 0, window * 2)
+    try:
+        count = cache.incr(current_key)
+    except ValueError:
+        # the counter expired between add and incr
+        cache.set(current_key, 1, window * 2)
+        count = 1
+    return cache.get(previous_key, 0) * overlap + count > limit
+
+
+async def ais_limited(name, limit, window, now=None):
+    now = time.time() if now is None else now
+    current_key, previous_key, overlap = _window_keys(name, window, now)
+    await cache.aadd(current_key, 0, window * 2)
+    try:
+        count = await cache.aincr(current_key)
+    except ValueError:
+        await cache.aset(current_key, 1, window * 2)
+        count = 1
+    return await cache.aget(previous_key, 0) * overlap + count > limit
+
+
+def _client_key(request, user, key):
+    if key == 'user' and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{request.META.get("REMOTE_ADDR")}'
+
+
+def rate_limit(key, rate):
+    # Limits a view per client IP or per signed-in user, raising
+    # Ratelimited (a 403) once the rate is exceeded. Works on sync and
+    # async views; async ones resolve the user without blocking the loop.
+    limit, window = parse_rate(rate)
+
+    def decorator(fn):
+        group = f'{fn.__module__}.{fn.__qualname__}'
+
+        if iscoroutinefunction(fn):
+            @wraps(fn)
+            async def _wrapped(request, *args, **kw):
+                user = request.user = await request.auser()
+                if await ais_limited(f'{group}:{_client_key(request, user, key)}', limit, window):
+                    raise Ratelimited()
+                return await fn(request, *args, **kw)
+        else:
+            @wraps(fn)
+            def _wrapped(request, *args, **kw):
+                if is_limited(f'{group}:{_client_key(request, request.user, key)}', limit, window):
+                    raise Ratelimited()
+                return fn(request, *args, **kw)
+        return _wrapped
+    return decorator
+
+
+class TokenBucket:
+    # Per-socket message limit: `rate` messages a second on average with
+    # bursts of up to `burst`. Kept in the consumer itself, so checking it
+    # is a little arithmetic and touches no shared store.
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class MessageLimiter:
+    # One bucket per message type, with rates from SOCKET_MESSAGE_RATES.
+    # Types not listed there share one bucket at SOCKET_DEFAULT_RATE, so a
+    # client cannot grow the dict by inventing types. Rates of None turn
+    # the limit off.
+
+    def __init__(self, rates=None, default=None):
+        self.rates = settings.SOCKET_MESSAGE_RATES if rates is None else rates
+        self.default = settings.SOCKET_DEFAULT_RATE if default is None else default
+        self.buckets = {}
+
+    def kind(self, message_type):
+        if isinstance(message_type, str) and message_type in self.rates:
+            return message_type
+        return None
+
+    def allow(self, message_type, now=None):
+        if self.rates is None:
+            return True
+        message_type = self.kind(message_type)
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            bucket = self.buckets[message_type] = TokenBucket(*self.rates.get(message_type, self.default), now)
+        return bucket.take(now)
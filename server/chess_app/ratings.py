@@ -0,0 +1,105 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from .models import Game, Rating
+
+MAX_WRITE_ATTEMPTS = 3
+PROVISIONAL_GAMES = 30
+LEADERBOARD_CACHE_KEY = 'leaderboard:top'
+
+SCORES = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+
+def expected_score(rating, opponent):
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def k_factor(games):
+    # New players move faster until their rating settles.
+    return 40 if games < PROVISIONAL_GAMES else 20
+
+
+def elo(white, black, white_games, black_games, result):
+    score = SCORES[result]
+    expected = expected_score(white, black)
+    return (
+        white + k_factor(white_games) * (score - expected),
+        black + k_factor(black_games) * (expected - score),
+    )
+
+
+def is_rated(game):
+    # Finished games between two people. Bot games do not count.
+    if game.status != 'finished' or game.result not in SCORES:
+        return False
+    if game.white_player is None or game.black_player is None:
+        return False
+    return settings.BOT_USERNAME not in (game.white_player.username, game.black_player.username)
+
+
+def record_result(game_id):
+    # Counts a finished game in both ratings exactly once. The game row is
+    # claimed and both ratings written with version checks in one
+    # transaction; if another result for either player landed first, the
+    # transaction is rolled back and the update redone on fresh ratings.
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        with transaction.atomic():
+            game = Game.objects.select_related('white_player', 'black_player').get(pk=game_id)
+            if game.rating_applied or not is_rated(game):
+                return False
+
+            white = rating_for(game.white_player_id)
+            black = rating_for(game.black_player_id)
+            new_white, new_black = elo(white.rating, black.rating, white.games, black.games, game.result)
+
+            if not Game.objects.filter(pk=game_id, rating_applied=False).update(rating_applied=True):
+                return False
+            if (white.compare_and_update(rating=new_white, games=white.games + 1)
+                    and black.compare_and_update(rating=new_black, games=black.games + 1)):
+                cache.delete(LEADERBOARD_CACHE_KEY)
+                return True
+            transaction.set_rollback(True)
+
+    raise RuntimeError(f'Could not rate game {game_id}: concurrent writes')
+
+
+arecord_result = database_sync_to_async(record_result)
+
+
+def rating_for(user_id):
+    rating, _ = Rating.objects.get_or_create(user_id=user_id, defaults={'rating': settings.DEFAULT_RATING})
+    return rating
+
+
+async def acurrent_rating(user):
+    rating = await Rating.objects.filter(user=user).values_list('rating', flat=True).afirst()
+    return settings.DEFAULT_RATING if rating is None else rating
+
+
+# Rank is the position on the leaderboard: rating descending, ties broken by
+# user id, so equal ratings get consecutive ranks exactly as listed there.
+LEADERBOARD_ORDER = [F('rating').desc(), F('user_id').asc()]
+
+
+def rank_players(batch_size=5000):
+    # Stores every player's leaderboard position in one pass over the
+    # rating index, writing only the ranks that changed. Returns how many.
+    ranked = (
+        Rating.objects
+        .annotate(position=Window(RowNumber(), order_by=LEADERBOARD_ORDER))
+        .values_list('pk', 'rank', 'position')
+    )
+    changed = []
+    updated = 0
+    for pk, rank, position in ranked.iterator(chunk_size=batch_size):
+        if rank != position:
+            changed.append(Rating(pk=pk, rank=position))
+        if len(changed) >= batch_size:
+            updated += Rating.objects.bulk_update(changed, ['rank'])
+            changed = []
+    if changed:
+        updated += Rating.objects.bulk_update(changed, ['rank'])
+    return updated
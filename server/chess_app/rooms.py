@@ -0,0 +1,468 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+import chess
+import chess.polyglot
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from channels.layers import get_channel_layer
+from . import metrics, protocol
+from .bots import bots
+from .clocks import Clock, scheduler
+from .models import GamePosition, Move
+from .positions import count_positions, position_key, positions, signed_key
+from .ratings import arecord_result
+from .store import store
+
+logger = logging.getLogger(__name__)
+
+
+class RoomOutOfSync(Exception):
+    def __init__(self, game, moves):
+        super().__init__(game.room_id)
+        self.game = game
+        self.moves = moves
+
+
+# Live state of an active game in one process. Moves are applied here and
+# the Game row is written behind it. When the players' sockets are served by
+# different processes, each process has its own RoomState and they stay in
+# step through the shared move log in the cache.
+class RoomState:
+    MAX_WRITE_ATTEMPTS = 3
+
+    def __init__(self, game, moves):
+        self.game_id = game.pk
+        self.room_id = game.room_id
+        self.group_name = f'game_{self.room_id}'
+        self.watch_group_name = f'watch_{self.room_id}'
+        self.load(game, moves)
+        self.connections = 0
+        self.spectators = 0
+        self.formats = Counter()
+        self._flush_task = None
+        self._flush_lock = None
+        self._bot_task = None
+        self._rating_task = None
+
+    def load(self, game, moves):
+        self.sync_from(game)
+        self.board = chess.Board(game.fen_position)
+        self.position = positions.get(self.board)
+        self.moves = [uci for uci, _ in moves]
+        self.position_counts = dict(game.position_counts) or count_positions(self.moves)
+        self.unsaved_moves = []
+        self.unsaved_positions = []
+        self.dirty = False
+        # the last move_made events, for sockets resuming after a drop
+        self.recent_moves = deque(maxlen=settings.ROOM_REPLAY_SIZE)
+        self.clock = None
+        if game.time_control_base:
+            self.clock = Clock(
+                game.time_control_base,
+                game.time_control_increment,
+                [played_at.timestamp() for _, played_at in moves],
+            )
+
+    def sync_from(self, game):
+        self.version = game.version
+        self.status = game.status
+        self.result = game.result
+        self.termination = game.termination
+        self.white_id = game.white_player_id
+        self.black_id = game.black_player_id
+        self.white_player = game.white_player.username if game.white_player else None
+        self.black_player = game.black_player.username if game.black_player else None
+        if self.white_player == settings.BOT_USERNAME:
+            self.bot_color = 'white'
+        elif self.black_player == settings.BOT_USERNAME:
+            self.bot_color = 'black'
+        else:
+            self.bot_color = None
+
+    def color_of(self, user):
+        if user.pk is not None and user.pk == self.white_id:
+            return 'white'
+        if user.pk is not None and user.pk == self.black_id:
+            return 'black'
+        return None
+
+    @property
+    def turn(self):
+        return 'white' if self.board.turn == chess.WHITE else 'black'
+
+    def legal_move(self, user, move_uci):
+        if self.status != 'playing':
+            return None
+
+        if self.color_of(user) != self.turn:
+            return None
+
+        try:
+            move = chess.Move.from_uci(move_uci)
+        except ValueError:
+            return None
+
+        if move.uci() not in self.position.legal_moves:
+            return None
+        return move
+
+    def apply_move(self, user, move_uci, now=None):
+        move = self.legal_move(user, move_uci)
+        if move is None:
+            return False
+        self.push_move(move, now or timezone.now())
+        return True
+
+    def push_move(self, move, now):
+        move_uci = move.uci()
+        if self.board.is_irreversible(move):
+            self.position_counts.clear()
+        self.board.push(move)
+        zobrist = chess.polyglot.zobrist_hash(self.board)
+        self.position = positions.get(self.board, zobrist)
+        key = position_key(zobrist)
+        self.position_counts[key] = self.position_counts.get(key, 0) + 1
+        self.moves.append(move_uci)
+        ply = len(self.moves)
+        self.unsaved_moves.append(Move(game_id=self.game_id, ply=ply, uci=move_uci, played_at=now))
+        self.unsaved_positions.append(GamePosition(game_id=self.game_id, ply=ply, zobrist=signed_key(zobrist)))
+        self.dirty = True
+        if self.clock is not None:
+            self.clock.press(now.timestamp())
+
+        termination = self.position.termination
+        if termination == 'checkmate':
+            self.finish('1-0' if self.board.turn == chess.BLACK else '0-1', termination)
+        elif termination:
+            self.finish('1/2-1/2', termination)
+        elif self.position_counts[key] >= 3:
+            # No one can claim a draw here, so draw as soon as one is claimable.
+            self.finish('1/2-1/2', 'threefold_repetition')
+        elif self.board.halfmove_clock >= 100:
+            self.finish('1/2-1/2', 'fifty_moves')
+        else:
+            self.start_clock()
+
+    def log_key(self, ply):
+        return f'room-moves:{self.game_id}:{ply}'
+
+    async def catch_up(self):
+        # Applies the moves other processes have taken in this game since we
+        # last looked. They are written by us as well as by them; whichever
+        # write lands second skips the plies already stored.
+        while self.status == 'playing':
+            entry = await cache.aget(self.log_key(len(self.moves) + 1))
+            if entry is None:
+                return
+            move_uci, played_at = entry
+            self.push_move(chess.Move.from_uci(move_uci), datetime.fromtimestamp(played_at, dt_timezone.utc))
+            self.recent_moves.append({'type': 'move_made', **self.move_event()})
+            self.schedule_flush()
+
+    async def make_move(self, user, move_uci):
+        # Applies a move from a player or the bot, queues the write and tells
+        # both sides. Returns False if the move was not accepted. The ply is
+        # claimed in the move log first, so no two processes can each take a
+        # different move at the same ply.
+        while True:
+            move = self.legal_move(user, move_uci)
+            if move is None:
+                return False
+            now = timezone.now()
+            claimed = await cache.aadd(
+                self.log_key(len(self.moves) + 1),
+                [move.uci(), now.timestamp()],
+                settings.ROOM_MOVE_LOG_TIMEOUT,
+            )
+            if claimed:
+                break
+            await self.catch_up()
+        self.push_move(move, now)
+
+        event = {'type': 'move_made', **self.move_event()}
+        self.recent_moves.append(event)
+        await self.broadcast(event)
+        if self.status == 'finished':
+            await self.flush()
+        else:
+            self.schedule_flush()
+        self.schedule_bot_move()
+        return True
+
+    def schedule_bot_move(self):
+        if self.bot_color is None or self.status != 'playing' or self.turn != self.bot_color:
+            return
+        if self._bot_task is None or self._bot_task.done():
+            self._bot_task = asyncio.ensure_future(self.play_bot_move())
+
+    async def play_bot_move(self):
+        ply = len(self.moves)
+        try:
+            move_uci = await bots.best_move(list(self.moves), bots.move_time(self.clock, self.bot_color))
+        except Exception:
+            # nothing awaits this task, so a failed search would otherwise
+            # leave the bot silent for the rest of the game
+            logger.exception('Bot search failed in room %s', self.room_id)
+            move_uci = None
+
+        await self.catch_up()
+        # the room may have been closed or the game ended while searching
+        if self.connections == 0 or len(self.moves) != ply or self.status != 'playing':
+            return
+        if self.clock_expired():
+            await self.check_flag()
+            return
+
+        bot = User(pk=self.white_id if self.bot_color == 'white' else self.black_id)
+        if move_uci is None or not await self.make_move(bot, move_uci):
+            if move_uci is not None:
+                logger.error('Bot chose illegal move %s in room %s', move_uci, self.room_id)
+            await self.make_move(bot, next(iter(self.board.legal_moves)).uci())
+
+    def finish(self, result, termination):
+        self.status = 'finished'
+        self.result = result
+        self.termination = termination
+        self.dirty = True
+        scheduler.cancel(self.room_id)
+
+    def start_clock(self):
+        if self.clock is not None and self.status == 'playing' and self.clock.deadline() is not None:
+            scheduler.schedule(self.room_id, self.clock.deadline(), self.check_flag)
+
+    def stop_clock(self):
+        scheduler.cancel(self.room_id)
+
+    def clock_expired(self):
+        return self.status == 'playing' and self.clock is not None and self.clock.is_expired(time.time())
+
+    async def check_flag(self):
+        await self.catch_up()
+        if not self.clock_expired():
+            self.start_clock()
+            return False
+
+        winner = chess.BLACK if self.turn == 'white' else chess.WHITE
+        if self.board.has_insufficient_material(winner):
+            self.finish('1/2-1/2', 'timeout_vs_insufficient_material')
+        else:
+            self.finish('1-0' if winner == chess.WHITE else '0-1', 'timeout')
+
+        await self.broadcast({'type': 'game_over', **self.result_event()})
+        await self.flush()
+        return True
+
+    def clock_state(self):
+        return self.clock.state(time.time()) if self.clock is not None else None
+
+    def snapshot(self):
+        return {
+            'white_player': self.white_player,
+            'black_player': self.black_player,
+            'fen': self.board.fen(),
+            'status': self.status,
+            'moves': list(self.moves),
+            'ply': len(self.moves),
+            **self.result_event(),
+        }
+
+    def events_since(self, ply):
+        # What a socket that had seen `ply` half-moves missed: the buffered
+        # move events after it, the last one with the clock as it is now,
+        # and the result if the game ended without a move. None when the
+        # gap is no longer buffered and the socket needs a snapshot.
+        missed = len(self.moves) - ply if isinstance(ply, int) else -1
+        if not 0 <= missed <= len(self.recent_moves):
+            return None
+
+        events = list(islice(self.recent_moves, len(self.recent_moves) - missed, None))
+        if events:
+            events[-1] = {**events[-1], 'clock': self.clock_state()}
+        if self.status == 'finished' and (not events or events[-1]['status'] != 'finished'):
+            events.append({'type': 'game_over', **self.result_event()})
+        return events
+
+    def move_event(self):
+        return {
+            'ply': len(self.moves),
+            'move': self.moves[-1],
+            'fen': self.board.fen(),
+            **self.result_event(),
+        }
+
+    def result_event(self):
+        return {
+            'status': self.status,
+            'result': self.result,
+            'termination': self.termination,
+            'clock': self.clock_state(),
+        }
+
+    async def broadcast(self, event):
+        # Encoded once per wire format in use and forwarded as-is by every
+        # consumer, so the cost of a move does not grow with the audience.
+        channel_layer = get_channel_layer()
+        frame = protocol.frame(event, [name for name in protocol.FORMATS if self.formats[name]])
+        await metrics.group_send(channel_layer, self.group_name, frame)
+        if self.spectators:
+            await metrics.group_send(channel_layer, self.watch_group_name, frame)
+
+    def schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._delayed_flush())
+
+    def cancel_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(settings.ROOM_FLUSH_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self.dirty:
+                return
+            new_moves, self.unsaved_moves = self.unsaved_moves, []
+            new_positions, self.unsaved_positions = self.unsaved_positions, []
+            self.dirty = False
+            try:
+                await self.save_game(new_moves, new_positions)
+            except RoomOutOfSync as exc:
+                # The database has moves we never saw and the log no longer
+                # has, so what we hold is stale: drop it and show everyone
+                # the game as stored.
+                logger.error('Room %s fell behind the stored game; reloading it', self.room_id)
+                self.stop_clock()
+                self.load(exc.game, exc.moves)
+                self.start_clock()
+                await self.broadcast({'type': 'game_state_update', **self.snapshot()})
+                self.schedule_bot_move()
+                return
+            except Exception:
+                self.unsaved_moves = new_moves + self.unsaved_moves
+                self.unsaved_positions = new_positions + self.unsaved_positions
+                self.dirty = True
+                raise
+
+            if self.status == 'finished':
+                self.schedule_rating()
+
+    def schedule_rating(self):
+        # Rated off the move path, after the last move and the result are
+        # out. A failure leaves the game to recompute_ratings.
+        if self._rating_task is None or self._rating_task.done():
+            self._rating_task = asyncio.ensure_future(self.record_result())
+
+    async def record_result(self):
+        try:
+            await arecord_result(self.game_id)
+        except Exception:
+            logger.exception('Could not rate game %s', self.room_id)
+
+    async def wait_for_rating(self):
+        if self._rating_task is not None:
+            await self._rating_task
+
+    async def save_game(self, new_moves, new_positions):
+        # The board and move list here are authoritative. If the row was
+        # written elsewhere since we last saw it (the lobby, an abort, or
+        # another process serving the same game), take its seats and a
+        # finished result, skip the moves it already has, then write again.
+        # Stored moves that do not match ours mean we missed moves the log
+        # no longer has, and ours are refused.
+        for _ in range(self.MAX_WRITE_ATTEMPTS):
+            fields = {
+                'fen_position': self.board.fen(),
+                'status': self.status,
+                'result': self.result,
+                'termination': self.termination,
+                'position_counts': dict(self.position_counts),
+            }
+            if await store.append_moves(self.game_id, self.version, fields, new_moves, new_positions):
+                self.version += 1
+                return
+
+            game = await store.load_game(self.room_id)
+            stored_moves = await store.load_moves(game.pk)
+            if len(stored_moves) > len(self.moves):
+                await self.catch_up()
+            stored = len(stored_moves)
+            if [uci for uci, _ in stored_moves] != self.moves[:stored]:
+                raise RoomOutOfSync(game, stored_moves)
+            new_moves = [move for move in new_moves if move.ply > stored]
+            new_positions = [position for position in new_positions if position.ply > stored]
+            self.unsaved_moves = [move for move in self.unsaved_moves if move.ply > stored]
+            self.unsaved_positions = [position for position in self.unsaved_positions if position.ply > stored]
+            outcome = (self.status, self.result, self.termination)
+            self.sync_from(game)
+            if game.status != 'finished':
+                self.status, self.result, self.termination = outcome
+            else:
+                self.stop_clock()
+
+        raise RuntimeError(f'Could not save game {self.room_id}: concurrent writes')
+
+
+class RoomRegistry:
+    def __init__(self):
+        self._rooms = {}
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def get(self, room_id):
+        return self._rooms.get(room_id)
+
+    async def acquire(self, room_id):
+        room = self._rooms.get(room_id)
+        if room is None:
+            if room_id not in self._loading:
+                self._loading[room_id] = asyncio.ensure_future(self._load(room_id))
+            try:
+                room = await asyncio.shield(self._loading[room_id])
+            finally:
+                self._loading.pop(room_id, None)
+            if room is None:
+                return None
+            if room_id not in self._rooms:
+                self._rooms[room_id] = room
+                await room.check_flag()
+                room.schedule_bot_move()
+            room = self._rooms[room_id]
+
+        room.connections += 1
+        return room
+
+    async def release(self, room):
+        room.connections -= 1
+        if room.connections > 0:
+            return
+
+        await room.flush()
+        await room.wait_for_rating()
+        if room.connections == 0 and self._rooms.get(room.room_id) is room:
+            room.cancel_flush()
+            room.stop_clock()
+            del self._rooms[room.room_id]
+
+    async def _load(self, room_id):
+        game = await store.load_game(room_id)
+        if game is None:
+            return None
+        room = RoomState(game, await store.load_moves(game.pk))
+        await room.catch_up()
+        return room
+
+
+rooms = RoomRegistry()
@@ -4,4 +4,6 @@ from . import consumers
 websocket_urlpatterns = [
     path('ws/lobby/<str:room_id>/', consumers.LobbyConsumer.as_asgi()),
     path('ws/match/<str:room_id>/', consumers.ChessConsumer.as_asgi()),
+    path('ws/watch/<str:room_id>/', consumers.SpectatorConsumer.as_asgi()),
+    path('ws/matchmaking/', consumers.MatchmakingConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,206 @@
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.db import transaction
+from django.utils import timezone
+from channels.db import database_sync_to_async
+from . import metrics
+from .models import Game, GamePosition, Move
+
+
+# Data access for the consumer hot paths. OrmGameStore goes through the ORM
+# on the sync_to_async thread; PsycopgGameStore talks to Postgres from the
+# event loop over a pooled async connection. Both return Game instances with
+# white_player and black_player loaded.
+
+class OrmGameStore:
+    @database_sync_to_async
+    def load_game(self, room_id):
+        try:
+            return Game.objects.select_related('white_player', 'black_player').get(room_id=room_id)
+        except Game.DoesNotExist:
+            return None
+
+    @database_sync_to_async
+    def load_moves(self, game_id):
+        return list(Move.objects.filter(game_id=game_id).values_list('uci', 'played_at'))
+
+    @database_sync_to_async
+    def append_moves(self, game_id, version, fields, new_moves, new_positions=()):
+        with transaction.atomic():
+            updated = Game.objects.filter(pk=game_id, version=version).update(
+                **fields,
+                updated_at=timezone.now(),
+                version=F('version') + 1,
+            )
+            if updated:
+                Move.objects.bulk_create(new_moves)
+                GamePosition.objects.bulk_create(new_positions)
+        return bool(updated)
+
+    async def update_game(self, game, **fields):
+        return await game.acompare_and_update(**fields)
+
+
+class PsycopgGameStore:
+    GAME_COLUMNS = (
+        'id', 'room_id', 'status', 'white_player_ready', 'black_player_ready',
+        'fen_position', 'created_at', 'updated_at', 'version',
+        'white_player_id', 'black_player_id', 'time_control_base',
+        'time_control_increment', 'result', 'termination', 'position_counts',
+    )
+
+    def __init__(self, min_size, max_size):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+        game_table = Game._meta.db_table
+        user_table = User._meta.db_table
+        self.move_table = Move._meta.db_table
+        self.game_table = game_table
+        columns = ', '.join(f'g.{column}' for column in self.GAME_COLUMNS)
+        self.load_game_sql = (
+            f'SELECT {columns}, w.username, b.username FROM {game_table} g '
+            f'LEFT JOIN {user_table} w ON w.id = g.white_player_id '
+            f'LEFT JOIN {user_table} b ON b.id = g.black_player_id '
+            f'WHERE g.room_id = %s'
+        )
+        self.load_moves_sql = f'SELECT uci, played_at FROM {self.move_table} WHERE game_id = %s ORDER BY ply'
+        self.append_move_sql = (
+            f'INSERT INTO {self.move_table} (game_id, ply, uci, played_at) VALUES (%s, %s, %s, %s)'
+        )
+        self.append_position_sql = (
+            f'INSERT INTO {GamePosition._meta.db_table} (game_id, ply, zobrist) VALUES (%s, %s, %s)'
+        )
+
+    async def execute(self, conn, sql, params):
+        started = time.perf_counter()
+        try:
+            return await conn.execute(sql, params)
+        finally:
+            metrics.record_query(time.perf_counter() - started)
+
+    async def connection(self):
+        # The pool is made on first use, so it connects to the database
+        # Django is using by then; under pytest that is the test database.
+        if self.pool is None:
+            from psycopg_pool import AsyncConnectionPool
+
+            self.pool = AsyncConnectionPool(
+                database_conninfo(),
+                min_size=self.min_size,
+                max_size=self.max_size,
+                kwargs={'autocommit': True},
+                open=False,
+            )
+        if self.pool.closed:
+            await self.pool.open()
+        return self.pool.connection()
+
+    async def load_game(self, room_id):
+        async with await self.connection() as conn:
+            cursor = await self.execute(conn, self.load_game_sql, (room_id,))
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+
+        *values, white_name, black_name = row
+        game = Game(**dict(zip(self.GAME_COLUMNS, values)))
+        game._state.adding = False
+        game._state.db = 'default'
+        game.white_player = User(pk=game.white_player_id, username=white_name) if white_name else None
+        game.black_player = User(pk=game.black_player_id, username=black_name) if black_name else None
+        return game
+
+    async def load_moves(self, game_id):
+        async with await self.connection() as conn:
+            cursor = await self.execute(conn, self.load_moves_sql, (game_id,))
+            return await cursor.fetchall()
+
+    def update_sql(self, fields):
+        fields['updated_at'] = timezone.now()
+        columns = {Game._meta.get_field(name).column: name for name in fields}
+        assignments = ', '.join(f'{column} = %s' for column in columns)
+        params = [self._db_value(fields[name]) for name in columns.values()]
+        sql = (
+            f'UPDATE {self.game_table} SET {assignments}, version = version + 1 '
+            f'WHERE id = %s AND version = %s'
+        )
+        return sql, params
+
+    async def append_moves(self, game_id, version, fields, new_moves, new_positions=()):
+        sql, params = self.update_sql(dict(fields))
+        async with await self.connection() as conn:
+            async with conn.transaction():
+                cursor = await self.execute(conn, sql, params + [game_id, version])
+                if not cursor.rowcount:
+                    return False
+                started = time.perf_counter()
+                async with conn.cursor() as moves_cursor:
+                    await moves_cursor.executemany(
+                        self.append_move_sql,
+                        [(game_id, move.ply, move.uci, move.played_at) for move in new_moves],
+                    )
+                    if new_positions:
+                        await moves_cursor.executemany(
+                            self.append_position_sql,
+                            [(game_id, position.ply, position.zobrist) for position in new_positions],
+                        )
+                metrics.record_query(time.perf_counter() - started)
+        return True
+
+    async def update_game(self, game, **fields):
+        sql, params = self.update_sql(fields)
+        async with await self.connection() as conn:
+            cursor = await self.execute(conn, sql, params + [game.pk, game.version])
+            if not cursor.rowcount:
+                return False
+
+        for name, value in fields.items():
+            setattr(game, name, value)
+        game.version += 1
+        return True
+
+    @staticmethod
+    def _db_value(value):
+        from psycopg.types.json import Jsonb
+
+        if isinstance(value, User):
+            return value.pk
+        if isinstance(value, dict):
+            return Jsonb(value)
+        return value
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+
+def database_conninfo():
+    from psycopg.conninfo import make_conninfo
+
+    database = settings.DATABASES['default']
+    params = {
+        'dbname': database.get('NAME'),
+        'user': database.get('USER'),
+        'password': database.get('PASSWORD'),
+        'host': database.get('HOST'),
+        'port': database.get('PORT'),
+        # as Django sets it, whatever the server's default encoding
+        'client_encoding': 'UTF8',
+    }
+    return make_conninfo(**{key: value for key, value in params.items() if value})
+
+
+def create_store(pool_size=None):
+    if pool_size is None:
+        pool_size = settings.ASYNC_DB_POOL_SIZE
+    if pool_size <= 0 or 'postgresql' not in settings.DATABASES['default']['ENGINE']:
+        return OrmGameStore()
+    return PsycopgGameStore(min_size=1, max_size=pool_size)
+
+
+store = create_store()
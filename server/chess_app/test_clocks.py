@@ -0,0 +1,48 @@
+import asyncio
+import time
+from asgiref.sync import async_to_sync
+from chess_app.clocks import Clock, ClockScheduler
+
+
+def test_clock_is_rebuilt_from_move_times():
+    clock = Clock(60, 2, [1000.0, 1010.0, 1015.0])
+
+    assert clock.turn == 'black'
+    # white's first move is free; white then spent 5s on the third move
+    assert clock.remaining['white'] == 60 + 2 - 5 + 2
+    assert clock.remaining['black'] == 60 - 10 + 2
+    assert clock.time_left('black', 1020.0) == 52 - 5
+    assert clock.deadline() == 1015.0 + 52
+
+
+def test_clock_expires_when_time_runs_out():
+    clock = Clock(10, 0, [0.0])
+
+    assert not clock.is_expired(9.5)
+    assert clock.is_expired(10.0)
+    assert clock.state(12.0) == {'white': 10.0, 'black': 0, 'running': 'black'}
+
+
+def test_scheduler_fires_only_current_deadlines():
+    fired = []
+
+    async def run():
+        scheduler = ClockScheduler()
+
+        def callback(name):
+            async def fire():
+                fired.append(name)
+            return fire
+
+        scheduler.schedule('a', time.time() + 0.05, callback('a-old'))
+        scheduler.schedule('a', time.time() + 0.1, callback('a'))
+        scheduler.schedule('b', time.time() + 0.02, callback('b'))
+        scheduler.schedule('c', time.time() + 0.03, callback('c'))
+        scheduler.cancel('c')
+        assert len(scheduler) == 2
+
+        await asyncio.sleep(0.2)
+        assert len(scheduler) == 0
+
+    async_to_sync(run)()
+    assert fired == ['b', 'a']
@@ -0,0 +1,636 @@
+import json
+import chess
+import msgpack
+import pytest
+from datetime import timedelta
+from concurrent.futures.process import BrokenProcessPool
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from chess_app import metrics, protocol
+from chess_app import rooms as rooms_module
+from chess_app.bots import bots
+from chess_app.models import Game, Move, Rating
+from chess_app.routing import websocket_urlpatterns
+from chess_app.rooms import RoomState, rooms
+from chess_app.store import store
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+application = URLRouter(websocket_urlpatterns)
+
+
+@pytest.fixture
+def game():
+    white = User.objects.create_user(username='white', password='complexPassword1!')
+    black = User.objects.create_user(username='black', password='complexPassword1!')
+    return Game.objects.create(white_player=white, black_player=black, status='playing')
+
+
+async def connect(game, user, path='match', subprotocols=None, since=None):
+    url = f'/ws/{path}/{game.room_id}/' + (f'?since={since}' if since is not None else '')
+    communicator = WebsocketCommunicator(application, url, subprotocols=subprotocols)
+    communicator.scope['user'] = user
+    connected, communicator.subprotocol = await communicator.connect()
+    assert connected
+    return communicator
+
+
+def test_move_is_applied_in_memory_and_written_behind(game, settings):
+    settings.ROOM_FLUSH_DELAY = 60
+
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        event = await black.receive_json_from()
+        assert event == {
+            'type': 'move_made',
+            'ply': 1,
+            'move': 'e2e4',
+            'fen': 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1',
+            'status': 'playing',
+            'result': '',
+            'termination': '',
+            'clock': None,
+        }
+
+        game_row = await Game.objects.aget(pk=game.pk)
+        assert await game_row.moves.acount() == 0
+        assert rooms.get(game.room_id).dirty
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+    game.refresh_from_db()
+    assert game.move_list() == ['e2e4']
+    assert game.fen_position.startswith('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b')
+    # e4 is a pawn move, so only the position after it is counted
+    assert list(game.position_counts.values()) == [1]
+    assert list(game.positions.values_list('ply', flat=True)) == [1]
+    assert rooms.get(game.room_id) is None
+
+
+def test_room_served_elsewhere_is_reloaded_instead_of_overwritten(game, settings):
+    settings.ROOM_FLUSH_DELAY = 0
+
+    async def play():
+        white = await connect(game, game.white_player)
+        await white.receive_json_from()
+
+        # a second process takes a move for the same game
+        other = RoomState(await store.load_game(game.room_id), [])
+        assert other.apply_move(game.white_player, 'e2e4')
+        await other.flush()
+
+        await white.send_json_to({'type': 'move', 'from': 'd2', 'to': 'd4'})
+        assert (await white.receive_json_from())['move'] == 'd2d4'
+        state = await white.receive_json_from()
+        assert (state['type'], state['moves']) == ('game_state_update', ['e2e4'])
+        assert rooms.get(game.room_id).moves == ['e2e4']
+
+        await white.disconnect()
+
+    async_to_sync(play)()
+    game.refresh_from_db()
+    assert game.move_list() == ['e2e4']
+    assert game.fen_position.startswith('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b')
+
+def test_rooms_in_different_processes_take_each_others_moves(game, settings):
+    settings.ROOM_FLUSH_DELAY = 60
+
+    async def play():
+        loaded = await store.load_game(game.room_id)
+        first, second, stale = RoomState(loaded, []), RoomState(loaded, []), RoomState(loaded, [])
+
+        assert await first.make_move(game.white_player, 'e2e4')
+        await first.flush()
+        # the other player's socket is served by a second process
+        await second.catch_up()
+        assert second.turn == 'black'
+        assert await second.make_move(game.black_player, 'e7e5')
+        await second.flush()
+
+        # a room that never caught up cannot take a ply someone else has,
+        # and checks the move again once it has caught up
+        assert not await stale.make_move(game.white_player, 'e2e4')
+        assert stale.moves == ['e2e4', 'e7e5']
+        assert await stale.make_move(game.white_player, 'g1f3')
+        assert stale.moves == ['e2e4', 'e7e5', 'g1f3']
+        await stale.flush()
+
+        for room in (first, second, stale):
+            room.cancel_flush()
+
+    async_to_sync(play)()
+    game.refresh_from_db()
+    assert game.move_list() == ['e2e4', 'e7e5', 'g1f3']
+    assert game.fen_position.startswith('rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b')
+
+def test_move_out_of_turn_is_ignored(game):
+    async def play():
+        black = await connect(game, game.black_player)
+        await black.receive_json_from()
+
+        await black.send_json_to({'type': 'move', 'from': 'e7', 'to': 'e5'})
+        assert await black.receive_nothing()
+        assert rooms.get(game.room_id).moves == []
+
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+
+def test_move_fan_out_runs_no_queries(game, settings):
+    settings.ROOM_FLUSH_DELAY = 60
+    moves_handled = metrics.handler_queries.series.get(('handle_move',), [0])[0]
+
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        queries = CaptureQueriesContext(connection)
+        await sync_to_async(queries.__enter__)()
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        white_state = await white.receive_json_from()
+        black_state = await black.receive_json_from()
+        await black.send_json_to({'type': 'move', 'from': 'e7', 'to': 'e5'})
+        await white.receive_json_from()
+        await black.receive_json_from()
+        await sync_to_async(queries.__exit__)(None, None, None)
+
+        assert await sync_to_async(len)(queries) == 0
+        assert white_state['ply'] == black_state['ply'] == 1
+        assert metrics.connections.values[('match',)] == 2
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+    # both moves were recorded in the zero-queries bucket
+    assert metrics.handler_queries.series[('handle_move',)][0] == moves_handled + 2
+    assert metrics.connections.values[('match',)] == 0
+
+
+def test_resync_sends_full_state_to_requesting_socket_only(game):
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        await black.send_json_to({'type': 'resync'})
+        state = await black.receive_json_from()
+        assert state['type'] == 'game_state_update'
+        assert state['moves'] == ['e2e4']
+        assert state['ply'] == 1
+        assert state['player_color'] == 'black'
+        assert await white.receive_nothing()
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+
+def test_flag_falls_on_the_shared_scheduler(game):
+    Game.objects.filter(pk=game.pk).update(time_control_base=1)
+
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        event = await black.receive_json_from()
+        assert event['clock']['running'] == 'black'
+
+        event = await black.receive_json_from(timeout=3)
+        assert event['type'] == 'game_over'
+        assert event['result'] == '1-0'
+        assert event['termination'] == 'timeout'
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+    game.refresh_from_db()
+    assert game.status == 'finished'
+    assert game.result == '1-0'
+
+
+def test_clock_is_restored_from_stored_move_times(game):
+    Game.objects.filter(pk=game.pk).update(time_control_base=60)
+    Move.objects.create(game=game, ply=1, uci='e2e4', played_at=timezone.now() - timedelta(minutes=2))
+
+    async def play():
+        communicator = await connect(game, game.black_player)
+        state = await communicator.receive_json_from()
+        assert (state['status'], state['result'], state['termination']) == ('finished', '0-1', 'timeout')
+        await communicator.disconnect()
+
+    async_to_sync(play)()
+
+    game.refresh_from_db()
+    assert game.status == 'finished'
+    assert game.termination == 'timeout'
+    assert rooms.get(game.room_id) is None
+
+
+def test_loadtest_reports_moves_and_latency(tmp_path):
+    output = tmp_path / 'report.json'
+    call_command('loadtest', pairs=2, plies=6, output=str(output))
+
+    report = json.loads(output.read_text())
+    assert report['moves'] == 12
+    assert report['errors'] == []
+    assert report['latency_ms']['p50'] is not None
+    assert not Game.objects.exists()
+
+
+def test_loadtest_stops_when_the_server_ends_the_game(tmp_path):
+    output = tmp_path / 'report.json'
+    call_command('loadtest', pairs=2, plies=400, seed=1, output=str(output))
+
+    report = json.loads(output.read_text())
+    assert report['errors'] == []
+    assert 0 < report['moves'] < 800
+
+
+def test_spectators_get_moves_encoded_once(game, monkeypatch):
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        spectators = [await connect(game, AnonymousUser(), path='watch') for _ in range(3)]
+        for spectator in spectators:
+            state = await spectator.receive_json_from()
+            assert state['type'] == 'game_state_update'
+            assert 'player_color' not in state
+
+        encoded = []
+        dumps = json.dumps
+        monkeypatch.setattr(protocol.json, 'dumps', lambda *args, **kwargs: encoded.append(1) or dumps(*args, **kwargs))
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        events = [await communicator.receive_json_from() for communicator in [white, black, *spectators]]
+        monkeypatch.undo()
+
+        # one encode for the move itself, one for the test client's send
+        assert len(encoded) == 2
+        assert all(event == events[0] for event in events)
+        assert events[0]['move'] == 'e2e4'
+
+        await spectators[0].send_json_to({'type': 'move', 'from': 'e7', 'to': 'e5'})
+        assert await spectators[0].receive_nothing()
+        assert rooms.get(game.room_id).moves == ['e2e4']
+
+        for communicator in [white, black, *spectators]:
+            await communicator.disconnect()
+
+    async_to_sync(play)()
+    assert rooms.get(game.room_id) is None
+
+
+def test_msgpack_subprotocol_sends_compact_binary_frames(game):
+    async def play():
+        white = await connect(game, game.white_player, subprotocols=[protocol.SUBPROTOCOL])
+        black = await connect(game, game.black_player)
+        assert white.subprotocol == protocol.SUBPROTOCOL
+        state = msgpack.unpackb(await white.receive_from())
+        assert state[0] == protocol.MESSAGE_CODES['game_state_update']
+        assert state[-1] == 'white'
+        await black.receive_json_from()
+
+        e2, e4 = chess.parse_square('e2'), chess.parse_square('e4')
+        await white.send_to(bytes_data=msgpack.packb([protocol.MESSAGE_CODES['move'], [e2, e4, 0]]))
+        event = msgpack.unpackb(await white.receive_from())
+        assert event[:3] == [protocol.MESSAGE_CODES['move_made'], 1, [e2, e4, 0]]
+        assert (await black.receive_json_from())['move'] == 'e2e4'
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+
+def test_malformed_msgpack_frames_are_ignored(game):
+    move = protocol.MESSAGE_CODES['move']
+    assert protocol.decode(msgpack.packb([move]), 'msgpack') == {}
+    assert protocol.decode(msgpack.packb([move, [12, 64, 0]]), 'msgpack') == {}
+    assert protocol.decode(msgpack.packb([move, [12, 28, 7]]), 'msgpack') == {}
+    assert protocol.decode(msgpack.packb([move, [12, 28]]), 'msgpack') == {}
+    assert protocol.decode(b'\xc1', 'msgpack') == {}
+
+    async def play():
+        white = await connect(game, game.white_player, subprotocols=[protocol.SUBPROTOCOL])
+        black = await connect(game, game.black_player)
+        await white.receive_from()
+        await black.receive_json_from()
+
+        await white.send_to(bytes_data=msgpack.packb([move, [12, 64, 0]]))
+        e2, e4 = chess.parse_square('e2'), chess.parse_square('e4')
+        await white.send_to(bytes_data=msgpack.packb([move, [e2, e4, 0]]))
+        assert (await black.receive_json_from())['move'] == 'e2e4'
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+def test_malformed_json_frames_are_ignored(game):
+    assert protocol.decode('not json', 'json') == {}
+    assert protocol.decode('[8]', 'json') == {}
+    assert protocol.decode('{"type": "move", "from": 12, "to": 28}', 'json') == {}
+
+    async def play():
+        white = await connect(game, game.white_player)
+        await white.receive_json_from()
+
+        for text in ('not json', '[8]', '{"type": "move", "from": 12, "to": 28}'):
+            await white.send_to(text_data=text)
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        assert (await white.receive_json_from())['move'] == 'e2e4'
+
+        await white.disconnect()
+
+    async_to_sync(play)()
+
+
+def test_frames_without_the_sockets_format_are_encoded_on_arrival(game):
+    async def play():
+        white = await connect(game, game.white_player, subprotocols=[protocol.SUBPROTOCOL])
+        await white.receive_from()
+
+        # as sent by a process that does not count this socket
+        event = {'type': 'game_over', 'status': 'finished', 'result': '1-0', 'termination': 'timeout', 'clock': None}
+        await get_channel_layer().group_send(f'game_{game.room_id}', protocol.frame(event, ['json']))
+        assert msgpack.unpackb(await white.receive_from()) == [
+            protocol.MESSAGE_CODES['game_over'], 'finished', '1-0', 'timeout', None,
+        ]
+
+        await white.disconnect()
+
+    async_to_sync(play)()
+
+def test_bot_replies_through_the_move_path(client, settings):
+    settings.BOT_MOVE_TIME = 0.1
+    user = User.objects.create_user(username='human', password='complexPassword1!')
+    client.force_login(user)
+    response = client.post(
+        reverse('create_room'), json.dumps({'opponent': 'bot'}), content_type='application/json',
+    )
+    assert response.json()['opponent'] == 'bot'
+    game = Game.objects.get(room_id=response.json()['room_id'])
+    assert game.status == 'playing'
+    assert settings.BOT_USERNAME in (game.white_player.username, game.black_player.username)
+
+    async def play():
+        human = await connect(game, user)
+        state = await human.receive_json_from()
+        if state['player_color'] == 'black':
+            event = await human.receive_json_from(timeout=10)
+            assert (event['type'], event['ply']) == ('move_made', 1)
+            await human.send_json_to({'type': 'move', 'from': 'a7', 'to': 'a6'})
+        else:
+            await human.send_json_to({'type': 'move', 'from': 'a2', 'to': 'a3'})
+        assert (await human.receive_json_from())['type'] == 'move_made'
+
+        reply = await human.receive_json_from(timeout=10)
+        assert reply['type'] == 'move_made'
+        assert reply['ply'] == (3 if state['player_color'] == 'black' else 2)
+        await human.disconnect()
+
+    async_to_sync(play)()
+    assert Game.objects.get(pk=game.pk).moves.count() >= 2
+
+
+def test_matchmaking_pairs_players_and_pushes_the_game():
+    alice = User.objects.create_user(username='alice', password='complexPassword1!')
+    bob = User.objects.create_user(username='bob', password='complexPassword1!')
+
+    async def seek(user):
+        communicator = WebsocketCommunicator(application, '/ws/matchmaking/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.send_json_to({'type': 'join_queue', 'time_control': {'base': 300, 'increment': 2}})
+        assert (await communicator.receive_json_from())['type'] == 'queue_joined'
+        return communicator
+
+    async def play():
+        first = await seek(alice)
+        assert await first.receive_nothing()
+        second = await seek(bob)
+
+        found = [await first.receive_json_from(), await second.receive_json_from()]
+        assert {event['type'] for event in found} == {'match_found'}
+        assert found[0]['room_id'] == found[1]['room_id']
+        assert {event['color'] for event in found} == {'white', 'black'}
+        assert found[0]['opponent'] == 'bob'
+
+        await first.disconnect()
+        await second.disconnect()
+        return found[0]['room_id']
+
+    room_id = async_to_sync(play)()
+    game = Game.objects.get(room_id=room_id)
+    assert game.status == 'playing'
+    assert (game.time_control_base, game.time_control_increment) == (300, 2)
+    assert {game.white_player, game.black_player} == {alice, bob}
+
+
+def test_checkmate_updates_both_ratings(game):
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        for sender, move in ((white, 'f2f3'), (black, 'e7e5'), (white, 'g2g4'), (black, 'd8h4')):
+            await sender.send_json_to({'type': 'move', 'from': move[:2], 'to': move[2:]})
+            await white.receive_json_from()
+            await black.receive_json_from()
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+    game.refresh_from_db()
+    assert (game.result, game.rating_applied) == ('0-1', True)
+    assert Rating.objects.get(user=game.black_player).rating == 1520
+    assert Rating.objects.get(user=game.white_player).rating == 1480
+
+
+def test_failed_rating_does_not_hold_back_the_last_move(game, monkeypatch):
+    async def broken_rating(game_id):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(rooms_module, 'arecord_result', broken_rating)
+
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        for sender, move in ((white, 'f2f3'), (black, 'e7e5'), (white, 'g2g4'), (black, 'd8h4')):
+            await sender.send_json_to({'type': 'move', 'from': move[:2], 'to': move[2:]})
+            event = await white.receive_json_from()
+            await black.receive_json_from()
+        assert (event['move'], event['status'], event['result']) == ('d8h4', 'finished', '0-1')
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+    game.refresh_from_db()
+    assert (game.status, game.result, game.rating_applied) == ('finished', '0-1', False)
+
+def test_chat_flood_is_dropped_before_it_is_handled(game, settings):
+    settings.SOCKET_MESSAGE_RATES = {'chat_message': (1, 3)}
+
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        dropped = metrics.dropped_messages.values.get(('chat_message',), 0)
+        for index in range(10):
+            await white.send_json_to({'type': 'chat_message', 'message': f'spam {index}'})
+
+        received = [(await black.receive_json_from())['message'] for _ in range(3)]
+        assert received == ['spam 0', 'spam 1', 'spam 2']
+        assert await black.receive_nothing()
+        assert metrics.dropped_messages.values[('chat_message',)] == dropped + 7
+
+        # other message types have their own budget
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        assert (await black.receive_json_from())['move'] == 'e2e4'
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
+
+
+def test_reconnect_replays_only_missed_moves_to_that_socket(game, settings):
+    settings.ROOM_REPLAY_SIZE = 2
+    game.time_control_base = 300
+    game.save()
+
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        for mover, uci in ((white, 'e2e4'), (black, 'e7e5'), (white, 'g1f3')):
+            await mover.send_json_to({'type': 'move', 'from': uci[:2], 'to': uci[2:]})
+            await white.receive_json_from()
+            await black.receive_json_from()
+
+        # back after seeing the first move: plies 2 and 3 only, and nobody
+        # else hears about the new socket
+        resumed = await connect(game, game.black_player, since=1)
+        events = [await resumed.receive_json_from() for _ in range(2)]
+        assert [(event['type'], event['ply'], event['move']) for event in events] == [
+            ('move_made', 2, 'e7e5'), ('move_made', 3, 'g1f3'),
+        ]
+        assert events[-1]['clock']['running'] == 'black'
+        assert await resumed.receive_nothing()
+        assert await white.receive_nothing()
+        assert await black.receive_nothing()
+
+        await resumed.send_json_to({'type': 'resume', 'ply': 3})
+        assert await resumed.receive_nothing()
+
+        # further back than the buffer reaches: the full state instead
+        await resumed.send_json_to({'type': 'resume', 'ply': 0})
+        state = await resumed.receive_json_from()
+        assert state['type'] == 'game_state_update'
+        assert state['moves'] == ['e2e4', 'e7e5', 'g1f3']
+        assert state['player_color'] == 'black'
+
+        for communicator in (white, black, resumed):
+            await communicator.disconnect()
+
+    async_to_sync(play)()
+
+
+def test_bot_plays_a_legal_move_when_its_search_fails(game, settings, monkeypatch):
+    bot = User.objects.create_user(username=settings.BOT_USERNAME)
+    Game.objects.filter(pk=game.pk).update(black_player=bot)
+
+    async def broken_search(moves, time_limit):
+        raise BrokenProcessPool('worker died')
+
+    monkeypatch.setattr(bots, 'best_move', broken_search)
+
+    async def play():
+        white = await connect(game, game.white_player)
+        await white.receive_json_from()
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        assert (await white.receive_json_from())['ply'] == 1
+        reply = await white.receive_json_from(timeout=5)
+        assert (reply['type'], reply['ply']) == ('move_made', 2)
+        await white.disconnect()
+
+    async_to_sync(play)()
+
+
+def test_player_who_dropped_before_the_end_gets_the_final_moves(game):
+    async def play():
+        white = await connect(game, game.white_player)
+        black = await connect(game, game.black_player)
+        await white.receive_json_from()
+        await black.receive_json_from()
+
+        for mover, uci in ((white, 'f2f3'), (black, 'e7e5'), (white, 'g2g4')):
+            await mover.send_json_to({'type': 'move', 'from': uci[:2], 'to': uci[2:]})
+            await white.receive_json_from()
+            await black.receive_json_from()
+
+        await white.disconnect()
+        await black.send_json_to({'type': 'move', 'from': 'd8', 'to': 'h4'})
+        assert (await black.receive_json_from())['status'] == 'finished'
+
+        white = await connect(game, game.white_player, since=3)
+        event = await white.receive_json_from()
+        assert (event['type'], event['ply'], event['move']) == ('move_made', 4, 'd8h4')
+        assert (event['status'], event['result'], event['termination']) == ('finished', '0-1', 'checkmate')
+        assert await white.receive_nothing()
+
+        # a finished game takes no more moves
+        await white.send_json_to({'type': 'move', 'from': 'e2', 'to': 'e4'})
+        assert await white.receive_nothing()
+
+        await white.disconnect()
+        await black.disconnect()
+
+    async_to_sync(play)()
@@ -0,0 +1,30 @@
+import time
+import chess
+from chess_app.engine import search
+
+
+def test_search_finds_mate_in_one():
+    moves = ['e2e4', 'e7e5', 'f1c4', 'b8c6', 'd1h5', 'g8f6']
+    assert search(chess.STARTING_FEN, moves, 1.0) == 'h5f7'
+
+
+def test_search_finds_a_back_rank_mate():
+    assert search('6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1', [], 1.0) == 'd1d8'
+
+
+def test_search_keeps_to_its_time_budget():
+    started = time.monotonic()
+    move = search(chess.STARTING_FEN, [], 0.2)
+    assert time.monotonic() - started < 1.0
+    assert chess.Move.from_uci(move) in chess.Board().legal_moves
+
+
+def test_search_moves_from_a_position_seen_before():
+    # the root repeats the position after 1.Nf3, which negamax scores as a
+    # draw without searching it
+    moves = ['g1f3', 'g8f6', 'f3g1', 'f6g8', 'g1f3']
+    move = search(chess.STARTING_FEN, moves, 0.3)
+    board = chess.Board()
+    for uci in moves:
+        board.push_uci(uci)
+    assert chess.Move.from_uci(move) in board.legal_moves
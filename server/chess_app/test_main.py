@@ -1,9 +1,23 @@
+import io
+import chess
 import pytest
 import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
 from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cached_db import SessionStore
 from django.urls import reverse
-from django.test import Client
-from chess_app.models import Game
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import AsyncClient, Client
+from django.utils import timezone
+from chess_app.auth import auth_middleware_stack, user_cache_key
+from chess_app.models import ArchivedGame, Game, GamePosition, Move, Rating
+from chess_app.ratings import expected_score, record_result
+from chess_app.routing import websocket_urlpatterns
 
 pytestmark = pytest.mark.django_db
 
@@ -89,4 +103,429 @@ def test_join_full_room_fails():
 
     response = client3.post(join_url, json.dumps(join_data), content_type='application/json')
     assert response.status_code == 400
-    assert response.json()['error'] == 'This game is already full'
\ No newline at end of file
+    assert response.json()['error'] == 'This game is already full'
+
+
+def test_game_data_returns_moves_in_order():
+    user1_data = {"username": "user1", "password": "complexPassword1!"}
+    user2_data = {"username": "user2", "password": "complexPassword1!"}
+
+    user1 = User.objects.create_user(**user1_data)
+    user2 = User.objects.create_user(**user2_data)
+    game = Game.objects.create(white_player=user1, black_player=user2, status='playing')
+    Move.objects.bulk_create([
+        Move(game=game, ply=2, uci='e7e5'),
+        Move(game=game, ply=1, uci='e2e4'),
+    ])
+
+    client1 = Client()
+    client1.login(**user1_data)
+
+    response = client1.get(reverse('game_data', args=[game.room_id]))
+    assert response.status_code == 200
+    assert response.json()['moves_history'] == ['e2e4', 'e7e5']
+
+def test_compare_and_update_rejects_stale_writes():
+    user1 = User.objects.create_user(username='user1', password='complexPassword1!')
+    game = Game.objects.create(white_player=user1)
+    stale = Game.objects.get(pk=game.pk)
+
+    assert game.compare_and_update(white_player_ready=True)
+    assert not stale.compare_and_update(status='playing')
+
+    game.refresh_from_db()
+    assert game.white_player_ready
+    assert game.status == 'waiting'
+    assert game.version == 1
+
+def test_create_room_is_rate_limited():
+    cache.clear()
+    user1_data = {"username": "user1", "password": "complexPassword1!"}
+    User.objects.create_user(**user1_data)
+    client1 = Client()
+    client1.login(**user1_data)
+
+    create_url = reverse('create_room')
+    for _ in range(20):
+        assert client1.post(create_url).status_code == 200
+    assert client1.post(create_url).status_code == 403
+    cache.clear()
+
+def test_create_room_with_time_control():
+    user1_data = {"username": "user1", "password": "complexPassword1!"}
+    User.objects.create_user(**user1_data)
+    client1 = Client()
+    client1.login(**user1_data)
+
+    create_url = reverse('create_room')
+    data = {'time_control': {'base': 180, 'increment': 2}}
+    response = client1.post(create_url, json.dumps(data), content_type='application/json')
+    assert response.status_code == 200
+    game = Game.objects.get(room_id=response.json()['room_id'])
+    assert (game.time_control_base, game.time_control_increment) == (180, 2)
+
+    data = {'time_control': {'base': 0}}
+    response = client1.post(create_url, json.dumps(data), content_type='application/json')
+    assert response.status_code == 400
+
+def test_metrics_endpoint_renders_prometheus_text(client):
+    user1 = User.objects.create_user(username='user1', password='complexPassword1!')
+    Game.objects.create(white_player=user1)
+    Game.objects.create(white_player=user1, status='finished')
+
+    response = client.get(reverse('metrics'))
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain')
+    body = response.content.decode()
+    assert '# TYPE kg_handler_duration_seconds histogram' in body
+    assert 'kg_games{status="waiting"} 1' in body
+    assert 'kg_games{status="playing"} 0' in body
+    assert 'kg_games{status="finished"}' not in body
+
+def test_export_pgn_streams_the_users_games():
+    white = User.objects.create_user(username='white', password='complexPassword1!')
+    black = User.objects.create_user(username='black', password='complexPassword1!')
+    other = User.objects.create_user(username='other', password='complexPassword1!')
+    mate = Game.objects.create(
+        white_player=white, black_player=black, status='finished', result='0-1', termination='checkmate',
+    )
+    for ply, uci in enumerate(['f2f3', 'e7e5', 'g2g4', 'd8h4'], start=1):
+        Move.objects.create(game=mate, ply=ply, uci=uci)
+    Game.objects.create(white_player=other, black_player=white, status='playing', time_control_base=300)
+    Game.objects.create(white_player=other, black_player=black, status='finished', result='1-0')
+    Game.objects.create(white_player=white)
+
+    async def download():
+        client = AsyncClient()
+        await client.aforce_login(white)
+        response = await client.get(reverse('export_pgn'))
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/x-chess-pgn'
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    pgn = async_to_sync(download)()
+    games = pgn.strip().split('\n\n[')
+    assert len(games) == 2
+    assert '[White "white"]' in games[0]
+    assert '[Result "0-1"]' in games[0]
+    assert '[Termination "checkmate"]' in games[0]
+    assert '1. f3 e5 2. g4 Qh4# 0-1' in games[0]
+    assert 'Black "white"]' in games[1]
+    assert '[TimeControl "300+0"]' in games[1]
+    assert games[1].endswith('*')
+
+def test_import_pgn_creates_finished_games_and_players(tmp_path):
+    User.objects.create_user(username='Alekhine', password='complexPassword1!')
+    pgn = tmp_path / 'games.pgn'
+    pgn.write_text(
+        '[Event "Casual"]\n[Date "1926.??.??"]\n[UTCDate "1926.03.14"]\n[UTCTime "15:30:00"]\n'
+        '[White "Alekhine"]\n[Black "Nimzowitsch"]\n[Result "0-1"]\n\n'
+        '1. f3 e5 2. g4 Qh4# 0-1\n\n'
+        '[White "Alekhine"]\n[Black "Nimzowitsch"]\n[Result "*"]\n\n1. e4 *\n\n'
+        '[White "Alekhine"]\n[Black "Capablanca"]\n[Result "1-0"]\n\n1. e4 e5 2. Ke3 1-0\n\n'
+        '[Date "1927.09.??"]\n[White "Capablanca"]\n[Black "?"]\n[Result "1/2-1/2"]\n[Termination "Time forfeit"]\n\n'
+        '1. d4 d5\n2. c4 1/2-1/2\n'
+    )
+
+    out = io.StringIO()
+    call_command('import_pgn', str(pgn), batch_size=2, workers=1, stdout=out)
+    assert 'Imported 2 games, skipped 2' in out.getvalue()
+
+    mate = Game.objects.get(white_player__username='Alekhine')
+    assert mate.status == 'finished'
+    assert (mate.result, mate.termination) == ('0-1', 'checkmate')
+    assert mate.black_player.username == 'Nimzowitsch'
+    assert not mate.black_player.has_usable_password()
+    assert mate.move_list() == ['f2f3', 'e7e5', 'g2g4', 'd8h4']
+    assert mate.positions.count() == 4
+    played = datetime(1926, 3, 14, 15, 30, tzinfo=dt_timezone.utc)
+    assert mate.created_at == played
+    assert set(mate.moves.values_list('played_at', flat=True)) == {played}
+
+    draw = Game.objects.get(white_player__username='Capablanca')
+    assert draw.black_player is None
+    assert draw.termination == 'time_forfeit'
+    assert draw.fen_position.startswith('rnbqkbnr/ppp1pppp/8/3p4/2PP4')
+    # an incomplete date is left as the import time
+    assert draw.created_at > timezone.now() - timedelta(minutes=1)
+    assert User.objects.filter(username='Alekhine').count() == 1
+
+def test_game_history_pages_newest_first_by_cursor(client):
+    player = User.objects.create_user(username='player', password='complexPassword1!')
+    other = User.objects.create_user(username='other', password='complexPassword1!')
+    now = timezone.now()
+    games = []
+    for index in range(5):
+        white, black = (player, other) if index % 2 == 0 else (other, player)
+        games.append(Game.objects.create(white_player=white, black_player=black, status='finished'))
+    Game.objects.create(white_player=other, status='finished')
+    Game.objects.create(white_player=player, status='waiting')
+    # the last three share a timestamp, so the id breaks the tie
+    for index, game in enumerate(games):
+        Game.objects.filter(pk=game.pk).update(created_at=now - timedelta(minutes=max(3 - index, 0)))
+
+    client.force_login(other)
+    url = reverse('game_history', args=['player'])
+    seen = []
+    cursor = None
+    for _ in range(3):
+        params = {'status': 'finished', 'limit': 2, **({'cursor': cursor} if cursor else {})}
+        response = client.get(url, params)
+        assert response.status_code == 200
+        seen += [game['room_id'] for game in response.json()['games']]
+        cursor = response.json()['next_cursor']
+    assert cursor is None
+    assert seen == [game.room_id for game in reversed(games)]
+
+    assert client.get(url, {'cursor': 'nonsense'}).status_code == 400
+    assert client.get(url, {'status': 'lost'}).status_code == 400
+    assert client.get(reverse('game_history', args=['nobody'])).status_code == 404
+
+def test_position_search_finds_games_through_the_index(client):
+    user = User.objects.create_user(username='user1', password='complexPassword1!')
+    italian = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4']
+    games = []
+    for moves in (italian, ['g1f3', 'b8c6', 'e2e4', 'e7e5', 'f1c4'], italian, ['d2d4']):
+        game = Game.objects.create(white_player=user, status='finished')
+        Move.objects.bulk_create([Move(game=game, ply=ply, uci=uci) for ply, uci in enumerate(moves, start=1)])
+        games.append(game)
+
+    out = io.StringIO()
+    call_command('index_positions', batch_size=3, stdout=out)
+    assert 'Indexed 16 positions from 4 games' in out.getvalue()
+    call_command('index_positions', stdout=io.StringIO())
+    assert GamePosition.objects.count() == 16
+
+    board = chess.Board()
+    for uci in italian:
+        board.push_uci(uci)
+
+    client.force_login(user)
+    url = reverse('position_search')
+    response = client.get(url, {'fen': board.fen(), 'limit': 2})
+    assert response.status_code == 200
+    page = response.json()
+    # the transposition reaches the same position
+    assert [game['room_id'] for game in page['games']] == [games[2].room_id, games[1].room_id]
+    assert page['games'][0]['ply'] == 5
+
+    response = client.get(url, {'fen': board.fen(), 'limit': 2, 'cursor': page['next_cursor']})
+    assert [game['room_id'] for game in response.json()['games']] == [games[0].room_id]
+    assert response.json()['next_cursor'] is None
+
+    # positions whose game row is gone are skipped
+    zobrist = GamePosition.objects.get(game=games[0], ply=5).zobrist
+    GamePosition.objects.create(game_id=games[-1].pk + 100, ply=5, zobrist=zobrist)
+    response = client.get(url, {'fen': board.fen()})
+    assert [game['room_id'] for game in response.json()['games']] == [games[2].room_id, games[1].room_id, games[0].room_id]
+
+    assert client.get(url, {'fen': 'not a fen'}).status_code == 400
+
+def finished_game(white, black, result):
+    return Game.objects.create(white_player=white, black_player=black, status='finished', result=result)
+
+def test_ratings_are_recorded_once_and_rank_the_leaderboard(client):
+    players = [User.objects.create_user(username=f'player{index}', password='complexPassword1!') for index in range(3)]
+    games = [
+        finished_game(players[0], players[1], '1-0'),
+        finished_game(players[0], players[2], '1-0'),
+        finished_game(players[1], players[2], '1-0'),
+    ]
+    for game in games:
+        assert record_result(game.pk)
+    assert not record_result(games[0].pk)
+
+    top = Rating.objects.get(user=players[0])
+    assert top.games == 2
+    assert top.rating == pytest.approx(1500 + 20 + 40 * (1 - expected_score(1520, 1500)))
+
+    response = client.get(reverse('leaderboard'), {'limit': 2})
+    page = response.json()
+    assert [(player['rank'], player['username']) for player in page['players']] == [(1, 'player0'), (2, 'player1')]
+    response = client.get(reverse('leaderboard'), {'limit': 2, 'cursor': page['next_cursor']})
+    assert [(player['rank'], player['username']) for player in response.json()['players']] == [(3, 'player2')]
+    assert response.json()['next_cursor'] is None
+
+    # ranks are read from the last snapshot
+    assert client.get(reverse('player_rating', args=['player2'])).json()['rank'] is None
+    call_command('rank_players', stdout=io.StringIO())
+    response = client.get(reverse('player_rating', args=['player2']))
+    assert response.json()['rank'] == 3
+
+    # a full recompute from history lands on the same ratings
+    before = {rating.user_id: rating.rating for rating in Rating.objects.all()}
+    call_command('recompute_ratings', stdout=io.StringIO())
+    after = {rating.user_id: rating.rating for rating in Rating.objects.all()}
+    assert after == pytest.approx(before)
+
+    # tied ratings are ranked in leaderboard order
+    Rating.objects.update(rating=1500)
+    call_command('rank_players', stdout=io.StringIO())
+    cache.clear()
+    listed = [player['username'] for player in client.get(reverse('leaderboard')).json()['players']]
+    for position, username in enumerate(listed, start=1):
+        assert client.get(reverse('player_rating', args=[username])).json()['rank'] == position
+
+def test_recompute_leaves_games_finished_during_the_replay_rated(client):
+    white = User.objects.create_user(username='white', password='complexPassword1!')
+    black = User.objects.create_user(username='black', password='complexPassword1!')
+    record_result(finished_game(white, black, '1-0').pk)
+    # finished, and rated on its own, after the replay read the games
+    late = finished_game(white, black, '0-1')
+    Game.objects.filter(pk=late.pk).update(updated_at=timezone.now() + timedelta(hours=1))
+    record_result(late.pk)
+
+    call_command('recompute_ratings', stdout=io.StringIO())
+    late.refresh_from_db()
+    assert late.rating_applied
+    assert Rating.objects.get(user=white).games == 2
+
+    with pytest.raises(CommandError):
+        call_command('recompute_ratings', batch_size=0)
+
+def test_leaderboard_first_page_is_cached_until_a_result(client):
+    cache.clear()
+    white = User.objects.create_user(username='white', password='complexPassword1!')
+    black = User.objects.create_user(username='black', password='complexPassword1!')
+    record_result(finished_game(white, black, '1-0').pk)
+
+    assert client.get(reverse('leaderboard')).json()['players'][0]['username'] == 'white'
+    Rating.objects.filter(user=black).update(rating=3000)
+    assert client.get(reverse('leaderboard')).json()['players'][0]['username'] == 'white'
+
+    record_result(finished_game(white, black, '0-1').pk)
+    assert client.get(reverse('leaderboard')).json()['players'][0]['username'] == 'black'
+
+def test_reap_games_ends_stale_games_and_archives_old_ones(client):
+    white = User.objects.create_user(username='white', password='complexPassword1!')
+    black = User.objects.create_user(username='black', password='complexPassword1!')
+    long_ago = timezone.now() - timedelta(days=60)
+
+    waiting = Game.objects.create(white_player=white)
+    abandoned = Game.objects.create(
+        white_player=white, black_player=black, status='playing',
+        fen_position='rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    )
+    Move.objects.bulk_create([Move(game=abandoned, ply=1, uci='e2e4'), Move(game=abandoned, ply=2, uci='e7e5')])
+    live = Game.objects.create(white_player=white, black_player=black, status='playing')
+    old = finished_game(white, black, '1-0')
+    Move.objects.bulk_create([Move(game=old, ply=1, uci='e2e4')])
+    Game.objects.filter(pk__in=[waiting.pk, abandoned.pk]).update(updated_at=timezone.now() - timedelta(days=2))
+    Game.objects.filter(pk=old.pk).update(updated_at=long_ago)
+    call_command('index_positions', stdout=io.StringIO())
+
+    out = io.StringIO()
+    call_command('reap_games', '--dry-run', stdout=out)
+    assert 'Would have aborted 1 waiting games, ended 1 abandoned games and archived 1' in out.getvalue()
+    assert Game.objects.filter(status='finished').count() == 1
+
+    out = io.StringIO()
+    call_command('reap_games', batch_size=1, stdout=out)
+    assert 'aborted 1 waiting games, ended 1 abandoned games and archived 1' in out.getvalue()
+
+    waiting.refresh_from_db()
+    assert (waiting.status, waiting.termination) == ('finished', 'aborted')
+    abandoned.refresh_from_db()
+    assert (abandoned.result, abandoned.termination, abandoned.rating_applied) == ('0-1', 'abandoned', True)
+    live.refresh_from_db()
+    assert live.status == 'playing'
+
+    assert not Game.objects.filter(pk=old.pk).exists()
+    assert not Move.objects.filter(game_id=old.pk).exists()
+    archived = ArchivedGame.objects.get(original_id=old.pk)
+    assert (archived.result, archived.move_list()) == ('1-0', ['e2e4'])
+    # rated on the way out, after the abandoned game
+    assert Rating.objects.get(user=white).games == 2
+
+    client.force_login(white)
+    board = chess.Board()
+    board.push_uci('e2e4')
+    response = client.get(reverse('position_search'), {'fen': board.fen()})
+    assert old.room_id in [game['room_id'] for game in response.json()['games']]
+
+    async def download():
+        async_client = AsyncClient()
+        await async_client.aforce_login(white)
+        response = await async_client.get(reverse('export_pgn'))
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    assert f'[Site "{old.room_id}"]' in async_to_sync(download)()
+
+def test_signed_in_user_is_cached_until_password_change(client, django_assert_num_queries):
+    user_data = {'username': 'cached', 'password': 'complexPassword1!'}
+    user = User.objects.create_user(**user_data)
+    client.post(reverse('login_user'), json.dumps(user_data), content_type='application/json')
+    status_url = reverse('check_auth_status')
+    assert client.get(status_url).json()['isAuthenticated']
+
+    with django_assert_num_queries(0):
+        assert client.get(status_url).json()['isAuthenticated']
+
+    # A new password ends the old session at once instead of after the TTL.
+    user.set_password('otherPassword2!')
+    user.save()
+    assert not client.get(status_url).json()['isAuthenticated']
+
+def test_logout_drops_cached_user(client):
+    user_data = {'username': 'leaving', 'password': 'complexPassword1!'}
+    user = User.objects.create_user(**user_data)
+    client.post(reverse('login_user'), json.dumps(user_data), content_type='application/json')
+    client.get(reverse('check_auth_status'))
+    assert cache.get(user_cache_key(user.pk)) is not None
+
+    client.post(reverse('logout_user'))
+    assert cache.get(user_cache_key(user.pk)) is None
+
+def test_game_history_continues_into_archived_games(client):
+    player = User.objects.create_user(username='player', password='complexPassword1!')
+    other = User.objects.create_user(username='other', password='complexPassword1!')
+    games = []
+    for index in range(5):
+        white, black = (player, other) if index % 2 == 0 else (other, player)
+        games.append(finished_game(white, black, '1-0'))
+    long_ago = timezone.now() - timedelta(days=60)
+    for index, game in enumerate(games[:3]):
+        Game.objects.filter(pk=game.pk).update(created_at=long_ago + timedelta(minutes=index), updated_at=long_ago)
+    call_command('reap_games', stdout=io.StringIO())
+    assert ArchivedGame.objects.count() == 3
+
+    client.force_login(other)
+    url = reverse('game_history', args=['player'])
+    seen = []
+    cursor = None
+    for _ in range(3):
+        response = client.get(url, {'limit': 2, **({'cursor': cursor} if cursor else {})})
+        seen += [(game['room_id'], game['status']) for game in response.json()['games']]
+        cursor = response.json()['next_cursor']
+    assert cursor is None
+    assert seen == [(game.room_id, 'finished') for game in reversed(games)]
+
+    assert client.get(url, {'status': 'playing'}).json()['games'] == []
+
+def test_sessions_from_before_the_cached_backend_move_over(client):
+    user = User.objects.create_user(username='returning', password='complexPassword1!')
+    client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+    assert client.get(reverse('check_auth_status')).json()['username'] == 'returning'
+    assert client.session[BACKEND_SESSION_KEY] == 'chess_app.auth.CachedModelBackend'
+
+def test_sockets_from_before_the_cached_backend_move_over(settings):
+    user = User.objects.create_user(username='returning', password='complexPassword1!')
+    session = SessionStore()
+    session.update({
+        SESSION_KEY: str(user.pk),
+        BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+        HASH_SESSION_KEY: user.get_session_auth_hash(),
+    })
+    session.create()
+
+    async def connect():
+        communicator = WebsocketCommunicator(
+            auth_middleware_stack(URLRouter(websocket_urlpatterns)), '/ws/matchmaking/',
+            headers=[(b'cookie', f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode())],
+        )
+        connected, _ = await communicator.connect()
+        await communicator.disconnect()
+        return connected
+
+    assert async_to_sync(connect)()
+    assert SessionStore(session.session_key)[BACKEND_SESSION_KEY] == 'chess_app.auth.CachedModelBackend'
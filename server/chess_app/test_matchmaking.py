@@ -0,0 +1,110 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from chess_app.matchmaking import Matchmaker, MatchQueue, Seeker
+
+
+def seeker(pk, rating, joined_at=0.0):
+    return Seeker(User(pk=pk, username=f'user{pk}'), rating, f'channel{pk}', joined_at, pk)
+
+
+def test_arrival_pairs_with_the_nearest_rating_in_the_window(settings):
+    settings.MATCHMAKING_WINDOW = 50
+    queue = MatchQueue()
+    assert queue.add(seeker(1, 1400), 0) is None
+    assert queue.add(seeker(2, 1600), 0) is None
+    assert queue.add(seeker(3, 2000), 0) is None
+
+    assert queue.add(seeker(4, 1580), 0).user.pk == 2
+    assert len(queue) == 2
+    assert queue.add(seeker(5, 1700), 0) is None
+
+
+def test_window_widens_while_waiting(settings):
+    settings.MATCHMAKING_WINDOW = 50
+    settings.MATCHMAKING_WINDOW_GROWTH = 10
+    settings.MATCHMAKING_MAX_WINDOW = 400
+    queue = MatchQueue()
+    queue.add(seeker(1, 1500), 0)
+    queue.add(seeker(2, 1650), 0)
+    queue.add(seeker(3, 2500), 0)
+
+    assert queue.sweep(5) == []
+    pairs = queue.sweep(10)
+    assert [(a.user.pk, b.user.pk) for a, b in pairs] == [(1, 2)]
+    # capped at the maximum window
+    assert queue.sweep(1000) == []
+    assert len(queue) == 1
+
+
+def test_a_player_is_never_paired_with_themselves():
+    queue = MatchQueue()
+    first = seeker(1, 1500)
+    queue.add(first, 0)
+    again = Seeker(first.user, 1500, 'other', 0, 99)
+    assert queue.add(again, 0) is None
+    queue.remove(first)
+    queue.remove(again)
+    assert len(queue) == 0
+
+
+def test_sweep_survives_players_leaving_while_games_start(settings):
+    settings.MATCHMAKING_WINDOW = 0
+    settings.MATCHMAKING_WINDOW_GROWTH = 100
+    time_control = (300, 0)
+    matchmaker = Matchmaker()
+    queue = matchmaker.queues[time_control] = MatchQueue()
+    seekers = [seeker(1, 1000), seeker(2, 1100), seeker(3, 3000), seeker(4, 3100)]
+    for each in seekers:
+        queue.insert(each)
+        matchmaker.seeking[each.user.pk] = (time_control, each)
+
+    started = []
+
+    async def start_game(first, second, time_control):
+        started.append((first.user.pk, second.user.pk))
+        # player 3 closes their socket while the first game is created
+        matchmaker.leave(seekers[2].user)
+
+    matchmaker.start_game = start_game
+    async_to_sync(matchmaker.sweep)(5.0)
+    assert started == [(1, 2)]
+    # player 4 is back in line instead of stranded
+    assert list(matchmaker.seeking) == [4]
+    assert queue.seekers == [seekers[3]]
+
+
+def test_players_are_requeued_when_their_game_cannot_start(settings):
+    settings.MATCHMAKING_WINDOW = 200
+    time_control = (300, 0)
+    matchmaker = Matchmaker()
+    queue = matchmaker.queues[time_control] = MatchQueue()
+    for each in (seeker(1, 1000), seeker(2, 1100)):
+        queue.insert(each)
+        matchmaker.seeking[each.user.pk] = (time_control, each)
+
+    async def start_game(first, second, time_control):
+        raise RuntimeError('database down')
+
+    matchmaker.start_game = start_game
+    async_to_sync(matchmaker.sweep)(0.0)
+    assert sorted(matchmaker.seeking) == [1, 2]
+    assert len(queue) == 2
+
+
+def test_arrival_is_requeued_with_its_opponent_when_their_game_cannot_start(settings):
+    settings.MATCHMAKING_WINDOW = 200
+    time_control = (300, 0)
+    matchmaker = Matchmaker()
+
+    async def start_game(first, second, time_control):
+        raise RuntimeError('database down')
+
+    async def play():
+        matchmaker.start_game = start_game
+        await matchmaker.join(User(pk=1, username='user1'), 1000, 'channel1', time_control)
+        await matchmaker.join(User(pk=2, username='user2'), 1100, 'channel2', time_control)
+        matchmaker._sweeper.cancel()
+
+    async_to_sync(play)()
+    assert sorted(matchmaker.seeking) == [1, 2]
+    assert len(matchmaker.queues[time_control]) == 2
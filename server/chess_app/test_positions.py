@@ -0,0 +1,119 @@
+import chess
+from django.contrib.auth.models import User
+from django.utils import timezone
+from chess_app.models import Game
+from chess_app.positions import PositionCache, count_positions
+from chess_app.rooms import RoomState
+
+
+def test_repeated_positions_are_served_from_the_cache():
+    cache = PositionCache(10)
+    board = chess.Board()
+
+    position = cache.get(board)
+    assert 'e2e4' in position.legal_moves
+    assert len(position.legal_moves) == 20
+    assert cache.get(chess.Board()) is position
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_rate() == 0.5
+
+
+def test_least_recently_used_position_is_evicted():
+    cache = PositionCache(2)
+    start = chess.Board()
+    after_e4 = chess.Board()
+    after_e4.push_uci('e2e4')
+    after_d4 = chess.Board()
+    after_d4.push_uci('d2d4')
+
+    cache.get(start)
+    cache.get(after_e4)
+    cache.get(start)
+    cache.get(after_d4)
+
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    cache.get(start)
+    assert cache.hits == 2
+
+
+def test_terminal_positions():
+    cache = PositionCache(10)
+    mate = chess.Board()
+    for uci in ('f2f3', 'e7e5', 'g2g4', 'd8h4'):
+        mate.push_uci(uci)
+
+    assert cache.get(mate).termination == 'checkmate'
+    assert cache.get(chess.Board('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1')).termination == 'stalemate'
+    assert cache.get(chess.Board('8/8/4k3/8/8/3K4/8/8 w - - 0 1')).termination == 'insufficient_material'
+    assert cache.get(chess.Board()).termination == ''
+
+
+SHUFFLE = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+def make_room(moves=(), fen=chess.STARTING_FEN):
+    white = User(pk=1, username='white')
+    black = User(pk=2, username='black')
+    board = chess.Board(fen)
+    for uci in moves:
+        board.push_uci(uci)
+    game = Game(
+        pk=1, room_id='room1', white_player=white, black_player=black,
+        status='playing', fen_position=board.fen(),
+    )
+    now = timezone.now()
+    return RoomState(game, [(uci, now) for uci in moves]), white, black
+
+
+def play(room, white, black, moves):
+    for uci in moves:
+        assert room.status == 'playing'
+        assert room.apply_move(white if room.turn == 'white' else black, uci)
+
+
+def test_threefold_repetition_ends_the_game():
+    room, white, black = make_room()
+
+    play(room, white, black, SHUFFLE + SHUFFLE[:3])
+    assert room.status == 'playing'
+    play(room, white, black, SHUFFLE[3:])
+    assert room.status == 'finished'
+    assert (room.result, room.termination) == ('1/2-1/2', 'threefold_repetition')
+
+
+def test_irreversible_moves_reset_the_position_counts():
+    room, white, black = make_room()
+
+    play(room, white, black, SHUFFLE + ['e2e4', 'e7e5'] + SHUFFLE)
+    assert room.status == 'playing'
+    assert max(room.position_counts.values()) == 2
+
+
+def test_position_counts_are_rebuilt_from_moves_once_on_load():
+    moves = SHUFFLE + SHUFFLE[:3]
+    room, white, black = make_room(moves)
+    assert room.position_counts == count_positions(moves)
+
+    play(room, white, black, SHUFFLE[3:])
+    assert room.termination == 'threefold_repetition'
+
+
+def test_fifty_move_rule_ends_the_game():
+    room, white, black = make_room(fen='4k3/8/8/8/8/8/8/R3K3 w - - 99 80')
+
+    play(room, white, black, ['a1a2'])
+    assert (room.result, room.termination) == ('1/2-1/2', 'fifty_moves')
+
+
+def test_resume_needs_a_snapshot_for_unbuffered_moves():
+    # moves loaded from the database are not in the replay buffer
+    room, white, black = make_room(['e2e4', 'e7e5'])
+    assert room.events_since(2) == []
+    assert room.events_since(1) is None
+    assert room.events_since(3) is None
+    assert room.events_since('2') is None
+
+    # a game that ended without a move still reports its result
+    room.finish('1-0', 'timeout')
+    assert room.events_since(2) == [{'type': 'game_over', **room.result_event()}]
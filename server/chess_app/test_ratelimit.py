@@ -0,0 +1,53 @@
+import pytest
+from django.core.cache import cache
+from chess_app.ratelimit import MessageLimiter, TokenBucket, is_limited, parse_rate
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_parse_rate():
+    assert parse_rate('10/m') == (10, 60)
+    assert parse_rate('20/h') == (20, 3600)
+
+
+def test_sliding_window_counts_the_overlapping_part_of_the_last_window():
+    # ten requests late in one minute
+    for _ in range(10):
+        assert not is_limited('test', 10, 60, now=6050.0)
+    assert is_limited('test', 10, 60, now=6055.0)
+
+    # 15s into the next minute three quarters of the last one still count
+    # (11 * 0.75 = 8.25), so only one more request fits
+    assert not is_limited('test', 10, 60, now=6075.0)
+    assert is_limited('test', 10, 60, now=6076.0)
+
+    # two minutes on, nothing from before counts
+    assert not is_limited('test', 10, 60, now=6180.0)
+
+
+def test_token_bucket_allows_bursts_then_refills():
+    bucket = TokenBucket(2, 3, 0.0)
+    assert [bucket.take(0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(0.5)
+    assert not bucket.take(0.5)
+    # refills up to the burst size only
+    assert [bucket.take(100.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_message_limiter_buckets_by_type():
+    limiter = MessageLimiter({'move': (1, 2)}, (1, 1))
+    assert limiter.allow('move', 0.0)
+    assert limiter.allow('move', 0.0)
+    assert not limiter.allow('move', 0.0)
+
+    # unknown and malformed types share one bucket
+    assert limiter.allow('made_up', 0.0)
+    assert not limiter.allow(['move'], 0.0)
+    assert set(limiter.buckets) == {'move', None}
+
+    assert MessageLimiter(None).allow('move')
@@ -0,0 +1,94 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from chess_app.models import Game, GamePosition, Move
+from chess_app.store import PsycopgGameStore, create_store
+
+# The psycopg store only runs on PostgreSQL. Its connections are separate
+# from Django's, so the rows these tests create have to be committed.
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.skipif(connection.vendor != 'postgresql', reason='needs PostgreSQL'),
+]
+
+
+@pytest.fixture
+def game():
+    white = User.objects.create_user(username='white', password='complexPassword1!')
+    return Game.objects.create(white_player=white, status='waiting')
+
+
+def run(coroutine_function):
+    # Runs against a fresh pool and closes it, whatever the test does.
+    async def wrapper():
+        store = create_store(2)
+        assert isinstance(store, PsycopgGameStore)
+        try:
+            return await coroutine_function(store)
+        finally:
+            await store.close()
+    return async_to_sync(wrapper)()
+
+
+def test_load_game_matches_the_orm(game):
+    async def check(store):
+        loaded = await store.load_game(game.room_id)
+        assert await store.load_game('missing') is None
+        return loaded
+
+    loaded = run(check)
+    assert (loaded.pk, loaded.room_id, loaded.status, loaded.version) == (game.pk, game.room_id, 'waiting', 0)
+    assert (loaded.white_player.pk, loaded.white_player.username) == (game.white_player_id, 'white')
+    assert loaded.black_player is None
+    assert loaded.created_at == game.created_at
+    assert loaded.position_counts == {}
+
+
+def test_load_moves_in_ply_order(game):
+    played_at = timezone.now()
+    Move.objects.bulk_create([
+        Move(game=game, ply=2, uci='e7e5', played_at=played_at),
+        Move(game=game, ply=1, uci='e2e4', played_at=played_at),
+    ])
+
+    moves = run(lambda store: store.load_moves(game.pk))
+    assert [tuple(move) for move in moves] == [('e2e4', played_at), ('e7e5', played_at)]
+
+
+def test_append_moves_writes_moves_only_on_the_current_version(game):
+    fields = {'fen_position': 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1', 'position_counts': {'a': 1}}
+    new_moves = [Move(game_id=game.pk, ply=1, uci='e2e4', played_at=timezone.now())]
+    new_positions = [GamePosition(game_id=game.pk, ply=1, zobrist=-42)]
+
+    async def append(store):
+        stale = await store.append_moves(game.pk, 1, fields, new_moves, new_positions)
+        current = await store.append_moves(game.pk, 0, fields, new_moves, new_positions)
+        return stale, current
+
+    assert run(append) == (False, True)
+    game.refresh_from_db()
+    assert game.version == 1
+    assert game.fen_position == fields['fen_position']
+    assert game.position_counts == {'a': 1}
+    assert game.move_list() == ['e2e4']
+    assert list(game.positions.values_list('ply', 'zobrist')) == [(1, -42)]
+
+
+def test_update_game_accepts_users_and_json(game):
+    black = User.objects.create_user(username='black', password='complexPassword1!')
+
+    async def update(store):
+        loaded = await store.load_game(game.room_id)
+        updated = await store.update_game(loaded, black_player=black, position_counts={'b': 2})
+        fresh = await store.update_game(await store.load_game(game.room_id), status='playing')
+        # loaded is now one version behind the row
+        conflict = await store.update_game(loaded, status='finished')
+        return updated, fresh, conflict
+
+    assert run(update) == (True, True, False)
+    game.refresh_from_db()
+    assert game.black_player == black
+    assert game.position_counts == {'b': 2}
+    assert (game.status, game.version) == ('playing', 2)
@@ -6,11 +6,18 @@ urlpatterns = [
     path('api/join-game/', views.join_game, name='join_game'),
     path('api/lobby-data/<str:room_id>', views.lobby_data, name='lobby_data'),
     path('api/game-data/<str:room_id>', views.game_data, name='game_data'),
+    path('api/export-pgn/', views.export_pgn, name='export_pgn'),
+    path('api/users/<str:username>/games/', views.game_history, name='game_history'),
+    path('api/positions/', views.position_search, name='position_search'),
+    path('api/leaderboard/', views.leaderboard, name='leaderboard'),
+    path('api/users/<str:username>/rating/', views.player_rating, name='player_rating'),
     path('api/get-csrf-token/', views.get_csrf_token, name='get_csrf_token'),
 
     path('api/register/', views.register_user, name='register_user'),
     path('api/login/', views.login_user, name='login_user'),
     path('api/logout/', views.logout_user, name='logout_user'),
-    path('api/user/', views.check_auth_status, name='check_auth_status')
+    path('api/user/', views.check_auth_status, name='check_auth_status'),
+
+    path('metrics', views.prometheus_metrics, name='metrics'),
 
 ]
\ No newline at end of file
@@ -1,25 +1,43 @@
+import base64
+import heapq
 import json
-from django.http import JsonResponse
+import random
+from datetime import datetime
+import chess
+import chess.polyglot
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout, password_validation
+from django.contrib.auth.hashers import make_password
 from django.db import IntegrityError
+from django.db.models import Count, F, Min, Prefetch, Q
 from django.middleware.csrf import get_token
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from asgiref.sync import async_to_sync
+from django.utils import timezone
 from channels.layers import get_channel_layer
-from .models import Game
-from django_ratelimit.decorators import ratelimit
+from . import metrics, protocol
+from .bots import bots
+from .clocks import parse_time_control
+from .models import ArchivedGame, Game, GamePosition, Move, Rating
+from .pgn import game_pgn
+from .positions import positions, signed_key
+from .ratings import LEADERBOARD_CACHE_KEY, LEADERBOARD_ORDER
+from .rooms import rooms
+from .ratelimit import rate_limit
 
-def check_auth_status(request):
-    if request.user.is_authenticated:
+async def check_auth_status(request):
+    user = await request.auser()
+    if user.is_authenticated:
         return JsonResponse({
             'isAuthenticated': True,
-            'username': request.user.username,
+            'username': user.username,
         }, status=200)
     else:
         return JsonResponse({'isAuthenticated': False}, status=401)
 
-@ratelimit(key='ip', rate='10/h', block=True)
+@rate_limit(key='ip', rate='10/h')
 def register_user(request):
     if request.method == 'POST':
         try:
@@ -47,7 +65,7 @@ def register_user(request):
     else:
         return JsonResponse({'error': 'Invalid request method'}, status=405)
 
-@ratelimit(key='ip', rate='10/m', block=True)
+@rate_limit(key='ip', rate='10/m')
 def login_user(request):
     if request.method == 'POST':
         try:
@@ -74,19 +92,60 @@ def logout_user(request):
     else:
         return JsonResponse({'error': 'Invalid request method'}, status=405)
 
-@ratelimit(key='user', rate='20/h', block=True)
-def create_room(request):
-    if request.method == 'POST' and request.user.is_authenticated:
-        game = Game.objects.create(white_player=request.user)
+async def create_bot_game(user, base, increment):
+    # Refuse new games rather than slow down the ones already running.
+    if bots.busy():
+        return JsonResponse({'error': 'All computer opponents are busy, try again shortly.'}, status=503)
+
+    bot, _ = await User.objects.aget_or_create(
+        username=settings.BOT_USERNAME, defaults={'password': make_password(None)},
+    )
+    white, black = (user, bot) if random.choice([True, False]) else (bot, user)
+    game = await Game.objects.acreate(
+        white_player=white,
+        black_player=black,
+        status='playing',
+        white_player_ready=True,
+        black_player_ready=True,
+        time_control_base=base,
+        time_control_increment=increment,
+    )
+    return JsonResponse({
+        'message': 'Room created successfully',
+        'room_id': game.room_id,
+        'opponent': 'bot',
+    })
+
+@rate_limit(key='user', rate='20/h')
+async def create_room(request):
+    user = await request.auser()
+    if request.method == 'POST' and user.is_authenticated:
+        try:
+            data = json.loads(request.body) if request.content_type == 'application/json' else {}
+            base, increment = parse_time_control(data)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if isinstance(data, dict) and data.get('opponent') == 'bot':
+            return await create_bot_game(user, base, increment)
+
+        game = await Game.objects.acreate(
+            white_player=user,
+            time_control_base=base,
+            time_control_increment=increment,
+        )
         return JsonResponse({
             'message': 'Room created successfully',
             'room_id': game.room_id,
         })
     return JsonResponse({'error': 'Invalid request or not authenticated'}, status=405)
 
-@ratelimit(key='user', rate='30/h', block=True)
-def join_game(request):
-    if request.method == 'POST' and request.user.is_authenticated:
+@rate_limit(key='user', rate='30/h')
+async def join_game(request):
+    user = await request.auser()
+    if request.method == 'POST' and user.is_authenticated:
         try:
             data = json.loads(request.body)
             room_id = data.get('room_id')
@@ -96,30 +155,36 @@ def join_game(request):
         if not room_id:
             return JsonResponse({'error': 'Room ID is required'}, status=400)
 
+        # Claim the black seat in one conditional UPDATE so two players
+        # joining at once cannot both get it.
+        claimed = await Game.objects.filter(
+            room_id=room_id, black_player__isnull=True
+        ).exclude(white_player=user).aupdate(
+            black_player=user,
+            updated_at=timezone.now(),
+            version=F('version') + 1,
+        )
+
         try:
-            game = Game.objects.get(room_id=room_id)
+            game = await Game.objects.select_related('white_player', 'black_player').aget(room_id=room_id)
         except Game.DoesNotExist:
             return JsonResponse({'error': 'This game does not exist'}, status=404)
-        
-        if game.white_player == request.user or game.black_player == request.user:
-            return JsonResponse({'room_id': game.room_id, 'message': 'Rejoining game.'})
 
-        if game.black_player is not None:
+        if not claimed:
+            if game.white_player == user or game.black_player == user:
+                return JsonResponse({'room_id': game.room_id, 'message': 'Rejoining game.'})
             return JsonResponse({'error': 'This game is already full'}, status=400)
 
-        game.black_player = request.user
-        game.save() 
-
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
+        await metrics.group_send(
+            get_channel_layer(),
             f'lobby_{game.room_id}',
-            {
+            protocol.frame({
                 'type': 'lobby_state_update',
                 'whitePlayer': game.white_player.username if game.white_player else None,
                 'blackPlayer': game.black_player.username if game.black_player else None,
                 'whitePlayerReady': game.white_player_ready,
                 'blackPlayerReady': game.black_player_ready,
-            }
+            })
         )
 
         return JsonResponse({
@@ -128,40 +193,42 @@ def join_game(request):
         })
     return JsonResponse({'error': 'Invalid request or not authenticated'}, status=405)
 
-def lobby_data(request, room_id):
-    if not request.user.is_authenticated:
+async def lobby_data(request, room_id):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'error': 'Not authenticated'}, status=401)
     
     try:
-        game = Game.objects.get(room_id=room_id)
+        game = await Game.objects.select_related('white_player', 'black_player').aget(room_id=room_id)
     except Game.DoesNotExist:
         return JsonResponse({'error': 'Game not found'}, status=404)
 
-    if request.user != game.white_player and request.user != game.black_player:
+    if user != game.white_player and user != game.black_player:
         return JsonResponse({'error': 'You are not authorized to view this game'}, status=403)
 
     return JsonResponse({
         'roomId': game.room_id,
         'whitePlayer': game.white_player.username if game.white_player else None,
         'blackPlayer': game.black_player.username if game.black_player else None,
-        'isUserWhite': request.user == game.white_player,
+        'isUserWhite': user == game.white_player,
         'whitePlayerReady': game.white_player_ready,
         'blackPlayerReady': game.black_player_ready
     })
 
-def game_data(request, room_id):
-    if not request.user.is_authenticated:
+async def game_data(request, room_id):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'error': 'Not authenticated'}, status=401)
     
     try:
-        game = Game.objects.get(room_id=room_id)
+        game = await Game.objects.select_related('white_player', 'black_player').aget(room_id=room_id)
     except Game.DoesNotExist:
         return JsonResponse({'error': 'Game not found'}, status=404)
 
-    if request.user != game.white_player and request.user != game.black_player:
+    if user != game.white_player and user != game.black_player:
         return JsonResponse({'error': 'You are not authorized to view this game'}, status=403)
 
-    if request.user == game.white_player:
+    if user == game.white_player:
         player_color = 'white'
         opponent_name = game.black_player.username if game.black_player else None
     else:
@@ -171,12 +238,248 @@ def game_data(request, room_id):
     return JsonResponse({
         'room_id': game.room_id,
         'player_color': player_color,
-        'player_name': request.user.username,
+        'player_name': user.username,
         'opponent_name': opponent_name,
         'waiting_for_opponent': game.status == 'waiting',
         'initial_position': game.fen_position,
-        'moves_history': game.moves
+        'moves_history': await game.amove_list()
     })
 
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+
+def history_key(game):
+    # Archived games keep their place in history under their old Game id.
+    return game.created_at, getattr(game, 'original_id', game.pk)
+
+def encode_cursor(game):
+    created_at, pk = history_key(game)
+    value = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+def decode_cursor(cursor):
+    created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pk)
+
+def history_item(game):
+    return {
+        'room_id': game.room_id,
+        'white_player': game.white_player.username if game.white_player else None,
+        'black_player': game.black_player.username if game.black_player else None,
+        'status': game.status,
+        'result': game.result,
+        'termination': game.termination,
+        'time_control': (
+            {'base': game.time_control_base, 'increment': game.time_control_increment}
+            if game.time_control_base else None
+        ),
+        'created_at': game.created_at.isoformat(),
+    }
+
+async def game_history(request, username):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+
+    try:
+        player = await User.objects.aget(username=username)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    games = Game.objects.select_related('white_player', 'black_player').order_by('-created_at', '-id')
+    archived = ArchivedGame.objects.select_related('white_player', 'black_player').order_by(
+        '-created_at', '-original_id',
+    )
+
+    status = request.GET.get('status')
+    if status:
+        if status not in dict(Game.STATUS_CHOICES):
+            return JsonResponse({'error': 'Invalid status'}, status=400)
+        games = games.filter(status=status)
+        if status != 'finished':
+            archived = archived.none()
+
+    try:
+        limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), MAX_HISTORY_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+        if request.GET.get('cursor'):
+            created_at, pk = decode_cursor(request.GET['cursor'])
+            games = games.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            archived = archived.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, original_id__lt=pk)
+            )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+
+    # One keyset query per colour and table, each served by its (player,
+    # created_at, id) index, merged here instead of an OR that no index
+    # can serve. Games archived by reap_games follow on from the live ones.
+    queries = [
+        games.filter(white_player=player),
+        games.filter(black_player=player),
+        archived.filter(white_player=player),
+        archived.filter(black_player=player),
+    ]
+    results = [[game async for game in query[:limit + 1]] for query in queries]
+    page = list(heapq.merge(*results, key=history_key, reverse=True))[:limit + 1]
+
+    return JsonResponse({
+        'games': [history_item(game) for game in page[:limit]],
+        'next_cursor': encode_cursor(page[limit - 1]) if len(page) > limit else None,
+    })
+
+async def position_search(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+
+    try:
+        board = chess.Board(request.GET.get('fen', ''))
+        limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), MAX_HISTORY_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+        cursor = int(request.GET['cursor']) if request.GET.get('cursor') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid fen, limit or cursor'}, status=400)
+
+    # Newest games first, keyed on the game id. Each page is one range scan
+    # of the (zobrist, game, ply) index.
+    matches = GamePosition.objects.filter(zobrist=signed_key(chess.polyglot.zobrist_hash(board)))
+    if cursor is not None:
+        matches = matches.filter(game_id__lt=cursor)
+    matches = matches.values('game_id').annotate(ply=Min('ply')).order_by('-game_id')
+    rows = [row async for row in matches[:limit + 1]]
+
+    first_ply = {row['game_id']: row['ply'] for row in rows[:limit]}
+    games = await Game.objects.select_related('white_player', 'black_player').ain_bulk(list(first_ply))
+    archived = ArchivedGame.objects.select_related('white_player', 'black_player').filter(
+        original_id__in=[pk for pk in first_ply if pk not in games],
+    )
+    games.update({game.original_id: game async for game in archived})
+    # a game deleted between the two queries is left out of the page
+    return JsonResponse({
+        'games': [{**history_item(games[pk]), 'ply': ply} for pk, ply in first_ply.items() if pk in games],
+        'next_cursor': str(rows[limit - 1]['game_id']) if len(rows) > limit else None,
+    })
+
+LEADERBOARD_CACHE_SECONDS = 60
+
+def leaderboard_item(rating, rank):
+    return {
+        'rank': rank,
+        'username': rating.user.username,
+        'rating': round(rating.rating),
+        'games': rating.games,
+    }
+
+async def leaderboard(request):
+    try:
+        limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), MAX_HISTORY_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+        cursor = request.GET.get('cursor')
+        if cursor:
+            rating, user_id, rank = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            rating, user_id, rank = float(rating), int(user_id), int(rank)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+
+    # The first page is what almost everyone asks for, so it is kept in the
+    # cache until a rated game changes it.
+    first_page = not cursor and limit == HISTORY_PAGE_SIZE
+    if first_page:
+        page = await cache.aget(LEADERBOARD_CACHE_KEY)
+        if page is not None:
+            return JsonResponse(page)
+
+    # Keyset pages over the (rating desc, user) index, no OFFSET.
+    ratings = Rating.objects.select_related('user').order_by(*LEADERBOARD_ORDER)
+    if cursor:
+        ratings = ratings.filter(Q(rating__lt=rating) | Q(rating=rating, user_id__gt=user_id))
+    else:
+        rank = 0
+    rows = [row async for row in ratings[:limit + 1]]
+
+    entries = [leaderboard_item(row, rank + index) for index, row in enumerate(rows[:limit], start=1)]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = base64.urlsafe_b64encode(f'{last.rating!r}|{last.user_id}|{rank + limit}'.encode()).decode()
+
+    page = {'players': entries, 'next_cursor': next_cursor}
+    if first_page:
+        await cache.aset(LEADERBOARD_CACHE_KEY, page, LEADERBOARD_CACHE_SECONDS)
+    return JsonResponse(page)
+
+async def player_rating(request, username):
+    try:
+        rating = await Rating.objects.select_related('user').aget(user__username=username)
+    except Rating.DoesNotExist:
+        if not await User.objects.filter(username=username).aexists():
+            return JsonResponse({'error': 'User not found'}, status=404)
+        return JsonResponse({'username': username, 'rating': settings.DEFAULT_RATING, 'games': 0, 'rank': None})
+
+    # Read from the snapshot kept by rank_players, not counted per request.
+    return JsonResponse(leaderboard_item(rating, rating.rank))
+
+PGN_EXPORT_CHUNK_SIZE = 500
+
+@rate_limit(key='user', rate='10/h')
+async def export_pgn(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+
+    games = (
+        Game.objects
+        .filter(Q(white_player=user) | Q(black_player=user))
+        .exclude(status='waiting')
+        .select_related('white_player', 'black_player')
+        .prefetch_related(Prefetch('moves', queryset=Move.objects.only('game_id', 'ply', 'uci')))
+        .order_by('created_at', 'pk')
+    )
+
+    # Games are read through a server-side cursor a chunk at a time, with
+    # one query for the moves of each chunk, so memory does not grow with
+    # the number of games.
+    archived = (
+        ArchivedGame.objects
+        .filter(Q(white_player=user) | Q(black_player=user))
+        .select_related('white_player', 'black_player')
+        .order_by('created_at', 'pk')
+    )
+
+    async def stream():
+        async for game in archived.aiterator(chunk_size=PGN_EXPORT_CHUNK_SIZE):
+            yield game_pgn(game, game.move_list())
+        async for game in games.aiterator(chunk_size=PGN_EXPORT_CHUNK_SIZE):
+            yield game_pgn(game, [move.uci for move in game.moves.all()])
+
+    response = StreamingHttpResponse(stream(), content_type='application/x-chess-pgn')
+    response['Content-Disposition'] = f'attachment; filename="{user.username}_games.pgn"'
+    return response
+
+async def prometheus_metrics(request):
+    # Unfinished games only, counted from the partial index on them; a count
+    # of every finished game would scan the whole table on each scrape.
+    counts = {'waiting': 0, 'playing': 0}
+    unfinished = Game.objects.filter(status__in=list(counts)).order_by()
+    async for row in unfinished.values('status').annotate(count=Count('id')):
+        counts[row['status']] = row['count']
+    for status, count in counts.items():
+        metrics.games.set(status, value=count)
+    metrics.live_rooms.set(value=len(rooms))
+    for stat, value in (
+        ('entries', len(positions)),
+        ('hits', positions.hits),
+        ('misses', positions.misses),
+        ('evictions', positions.evictions),
+        ('hit_rate', round(positions.hit_rate(), 4)),
+    ):
+        metrics.position_cache.set(stat, value=value)
+
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def get_csrf_token(request):
     return JsonResponse({'csrfToken': get_token(request)})
\ No newline at end of file
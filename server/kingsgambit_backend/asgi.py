@@ -7,13 +7,13 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kingsgambit_backend.settings')
 django_asgi_app = get_asgi_application()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from chess_app import routing as chess_app_routing
+from chess_app.auth import auth_middleware_stack
 
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": AuthMiddlewareStack( 
+    "websocket": auth_middleware_stack(
         URLRouter(
             chess_app_routing.websocket_urlpatterns
         )
@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'chess_app.auth.UpgradeSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -92,15 +93,117 @@ DATABASES = {
     }
 }
 
+# DATABASE_ENGINE=sqlite runs without PostgreSQL, e.g. for manage.py loadtest.
+if os.environ.get('DATABASE_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Size of the async psycopg pool used by the WebSocket consumers on
+# PostgreSQL. 0 sends their queries through the ORM instead.
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 10))
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [(os.environ.get('REDIS_HOST'), int(os.environ.get('REDIS_PORT')))],
+            "hosts": [(os.environ.get('REDIS_HOST'), int(os.environ.get('REDIS_PORT', 6379)))],
+        },
+    },
+}
+
+# CHANNEL_LAYER=memory runs a single process without Redis.
+if os.environ.get('CHANNEL_LAYER') == 'memory':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
         },
+    }
+
+# Shared cache for sessions, signed-in users, rate limits and the
+# leaderboard, in its own Redis database next to the channel layer.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.environ.get('REDIS_HOST')}:{int(os.environ.get('REDIS_PORT', 6379))}/1",
     },
 }
 
+# CACHE_BACKEND=memory keeps the cache in each process instead. Logouts and
+# password changes then only reach the process that handled them; other
+# processes notice once USER_CACHE_TTL runs out.
+if os.environ.get('CACHE_BACKEND') == 'memory':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Sessions are read from the cache and written through to the database, and
+# the user behind a session is cached for USER_CACHE_TTL seconds, so a
+# connect or request normally runs no queries to authenticate.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+# Sessions signed in through ModelBackend before are moved over to it on
+# their next request or socket connect (chess_app.auth.upgrade_session).
+AUTHENTICATION_BACKENDS = ['chess_app.auth.CachedModelBackend']
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+# Messages each WebSocket may send, by type, as (per second, burst).
+# Anything faster is dropped before it is handled. Types not listed share
+# SOCKET_DEFAULT_RATE; None turns the limit off.
+SOCKET_MESSAGE_RATES = {
+    'move': (4, 10),
+    'resync': (1, 3),
+    'resume': (1, 3),
+    'player_ready': (1, 3),
+    'chat_message': (1, 5),
+    'video_signal': (2, 10),
+    'join_queue': (1, 3),
+    'leave_queue': (1, 3),
+}
+SOCKET_DEFAULT_RATE = (1, 5)
+
+# Seconds a live room may hold unsaved moves before they are written to the
+# database. Finished games and rooms whose last socket closes are written
+# immediately.
+ROOM_FLUSH_DELAY = 2.0
+
+# Move events each live room keeps for sockets that reconnect with the last
+# ply they saw. Anyone further behind gets the full game state instead.
+ROOM_REPLAY_SIZE = 64
+
+# Seconds each move stays in the shared move log. The players of one game
+# may be served by different processes; each claims its moves' plies in the
+# log and picks up the other's from it before checking a move.
+ROOM_MOVE_LOG_TIMEOUT = 24 * 60 * 60
+
+# Positions whose legal moves and game-over status are kept in memory by
+# each process, least recently used first out. 0 disables the cache.
+POSITION_CACHE_SIZE = int(os.environ.get('POSITION_CACHE_SIZE', 20000))
+
+# Computer opponent. Searches run in BOT_WORKERS processes with up to
+# BOT_QUEUE_SIZE more waiting; BOT_UCI_ENGINE is the path of a UCI engine
+# binary to use instead of the built-in search.
+BOT_USERNAME = 'kingsgambit-bot'
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', 2))
+BOT_QUEUE_SIZE = int(os.environ.get('BOT_QUEUE_SIZE', 8))
+BOT_MOVE_TIME = float(os.environ.get('BOT_MOVE_TIME', 1.0))
+BOT_UCI_ENGINE = os.environ.get('BOT_UCI_ENGINE')
+
+DEFAULT_RATING = 1500
+
+# Matchmaking pairs players whose ratings differ by at most MATCHMAKING_WINDOW,
+# widening by MATCHMAKING_WINDOW_GROWTH points per second of waiting up to
+# MATCHMAKING_MAX_WINDOW. Waiting players are re-checked every
+# MATCHMAKING_SWEEP_INTERVAL seconds.
+MATCHMAKING_WINDOW = 50
+MATCHMAKING_WINDOW_GROWTH = 10
+MATCHMAKING_MAX_WINDOW = 400
+MATCHMAKING_SWEEP_INTERVAL = 1.0
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators